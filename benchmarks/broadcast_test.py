@@ -0,0 +1,175 @@
+"""
+Проверка ежедневной рассылки на большой аудитории против поддельного Bot API
+из load_test.py. Все подписчики «просрочены», рассылку запускает отдельный
+процесс; посреди рассылки он убивается SIGKILL и запускается заново.
+
+Проверяется, что:
+- ни один чат не получил фразу дважды;
+- после перезапуска разосланы все, кроме пачки, прерванной падением;
+- заблокировавшие бота (каждый --blocked-every) удалены из подписчиков;
+- скорость рассылки не превышает --rate.
+
+    python benchmarks/broadcast_test.py [--users 5000] [--rate 500] [--kill-after 3]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from load_test import ROOT, USER_ID_BASE, free_port, run_fake_api, wait_for_port
+
+sys.path.insert(0, ROOT)
+
+from aiogram.bot.api import TelegramAPIServer
+
+from broadcast import Broadcaster
+from database import Database
+from outbound import ScheduledBot
+
+TOKEN = '123456:TEST'
+
+
+def make_broadcaster(db, bot, args):
+    async def get_phrase(user_id):
+        return f'Фраза дня для {user_id}'
+    return Broadcaster(db, bot, get_phrase, rate=args.rate, batch_size=args.batch)
+
+
+async def prepare(path, args):
+    db = Database(path)
+    await db.connect()
+    await make_broadcaster(db, None, args).init()
+    due = int(time.time()) - 60
+    async with db.write() as conn:
+        await conn.executemany('INSERT INTO broadcast_subscribers (user_id, send_minute, next_at) VALUES (?, ?, ?)',
+                               [(USER_ID_BASE + i, 0, due) for i in range(args.users)])
+    await db.close()
+
+
+async def child(args):
+    """Один запуск рассылки, как её запускает бот: восстановление, затем все подошедшие."""
+    bot = ScheduledBot(TOKEN, server=TelegramAPIServer.from_base(f'http://127.0.0.1:{args.api_port}'),
+                       scheduler_options={'global_rate': args.rate * 2, 'chat_rate': 1, 'chat_burst': 1})
+    db = Database(args.db)
+    await db.connect()
+    broadcaster = make_broadcaster(db, bot, args)
+    bot.scheduler.start()
+    await broadcaster.recover()
+    started = time.perf_counter()
+    await broadcaster.run_due()
+    elapsed = time.perf_counter() - started
+    print(json.dumps({'sent': broadcaster.sent, 'pruned': broadcaster.pruned, 'failed': broadcaster.failed,
+                      'elapsed': elapsed}))
+    await bot.scheduler.stop()
+    await (await bot.get_session()).close()
+    await db.close()
+
+
+def run_child(args, timeout=None):
+    command = [sys.executable, os.path.abspath(__file__), '--child', '--db', args.db, '--api-port',
+               str(args.api_port), '--rate', str(args.rate), '--batch', str(args.batch)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    if timeout is not None:
+        time.sleep(timeout)
+        process.send_signal(signal.SIGKILL)
+        process.wait()
+        return None
+    output, _ = process.communicate()
+    return json.loads(output.strip().splitlines()[-1])
+
+
+async def fetch_stats(api_port):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f'http://127.0.0.1:{api_port}/stats') as response:
+            return await response.json()
+
+
+async def inspect(path):
+    db = Database(path)
+    await db.connect()
+    now = int(time.time())
+    remaining = (await db.fetchone('SELECT COUNT(*) FROM broadcast_subscribers'))[0]
+    due = (await db.fetchone('SELECT COUNT(*) FROM broadcast_subscribers WHERE next_at <= ?', (now,)))[0]
+    claimed = (await db.fetchone('SELECT COUNT(*) FROM broadcast_subscribers WHERE claimed_at IS NOT NULL'))[0]
+    await db.close()
+    return remaining, due, claimed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--rate', type=float, default=500, help='сообщений в секунду')
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--blocked-every', type=int, default=20, help='каждый N-й заблокировал бота')
+    parser.add_argument('--kill-after', type=float, default=3, help='через сколько секунд убить первый запуск')
+    parser.add_argument('--latency', type=float, default=20, help='задержка ответа Bot API, мс')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    parser.add_argument('--api-port', type=int, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.child:
+        asyncio.run(child(args))
+        return 0
+
+    workdir = tempfile.mkdtemp(prefix='bot-broadcast-')
+    args.db = os.path.join(workdir, 'phrases.db')
+    args.api_port = free_port()
+    server = multiprocessing.Process(target=run_fake_api, daemon=True, kwargs={
+        'port': args.api_port, 'latency': args.latency / 1000, 'upload_phrases': 0,
+        'blocked_every': args.blocked_every, 'count_chats': True})
+    server.start()
+    failures = []
+    try:
+        asyncio.run(prepare(args.db, args))
+        wait_for_port(args.api_port)
+        run_child(args, timeout=args.kill_after)
+        first = asyncio.run(fetch_stats(args.api_port))
+        print(f"Первый запуск убит через {args.kill_after} с: отправлено {first.get('chats', 0)}")
+        result = run_child(args)
+        calls = asyncio.run(fetch_stats(args.api_port))
+        remaining, due, claimed = asyncio.run(inspect(args.db))
+    finally:
+        server.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    delivered = calls.get('sendMessage', 0) - calls.get('blocked', 0)
+    chats = calls.get('chats', 0)
+    blocked_users = len([i for i in range(args.users) if (USER_ID_BASE + i) % args.blocked_every == 0])
+    skipped = args.users - chats - calls.get('blocked', 0)
+    resumed = chats - first.get('chats', 0)
+    rate = resumed / result['elapsed'] if result['elapsed'] else 0
+    print(f"Второй запуск: отправлено {result['sent']} за {result['elapsed']:.2f} с ({rate:.0f} сообщений/с), "
+          f"удалено заблокировавших {result['pruned']}")
+    print(f"Итого: получили фразу {chats} из {args.users}, заблокировали {calls.get('blocked', 0)}, "
+          f"пропущено из-за падения {skipped}, осталось подписчиков {remaining}")
+
+    if delivered != chats:
+        failures.append(f"повторные отправки: {delivered - chats}")
+    if skipped > args.batch:
+        failures.append(f"пропущено {skipped}, больше одной пачки ({args.batch})")
+    if due or claimed:
+        failures.append(f"после перезапуска осталось к отправке {due}, помеченных {claimed}")
+    if remaining < args.users - blocked_users:
+        failures.append(f"удалены лишние подписчики: осталось {remaining}")
+    if rate > args.rate * 1.1:
+        failures.append(f"скорость {rate:.0f} выше заданной {args.rate:.0f}")
+    for line in failures:
+        print(f"Ошибка: {line}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Микробенчмарк маршрутизации callback_query: прежняя цепочка lambda-фильтров
+против CallbackRouter. Обработчики пустые, меряется только выбор обработчика.
+
+    python benchmarks/callback_routing.py [число повторов]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+
+from router import CallbackRouter
+
+ADMIN_ID = 1
+WAITING_FOR_PHRASE = 'AdminStates:waiting_for_phrase'
+
+# (callback_data или префикс с ':', только для админа, состояние) в порядке регистрации из main.py
+ROUTES = [
+    ('get_phrase', False, None),
+    ('check_subscription', False, None),
+    ('daily', False, None),
+    ('daily_time:', False, None),
+    ('daily_off', False, None),
+    ('add_phrases', True, None),
+    ('confirm_add', False, WAITING_FOR_PHRASE),
+    ('add_more', True, None),
+    ('delete_phrases', True, None),
+    ('delete_all_phrases', True, None),
+    ('confirm_delete_all', True, None),
+    ('select_delete_phrases', True, None),
+    ('nav_delete:', True, None),
+    ('delete:', True, None),
+    ('confirm_delete:', True, None),
+    ('list_phrases', True, None),
+    ('export_phrases', True, None),
+    ('back_to_main', False, None),
+    ('admin_panel', False, '*'),
+    ('admin_panel', False, WAITING_FOR_PHRASE),
+    ('upload_phrases', True, None),
+]
+SAMPLES = ['get_phrase', 'back_to_main', 'nav_delete:>42', 'upload_phrases']
+
+
+async def noop(callback_query):
+    return True
+
+
+def make_filter(data, admin):
+    if data.endswith(':'):
+        if admin:
+            return lambda c: c.data.startswith(data) and c.from_user.id == ADMIN_ID
+        return lambda c: c.data.startswith(data)
+    if admin:
+        return lambda c: c.data == data and c.from_user.id == ADMIN_ID
+    return lambda c: c.data == data
+
+
+def filter_chain_dispatcher(bot):
+    dp = Dispatcher(bot, storage=MemoryStorage())
+    for data, admin, state in ROUTES:
+        dp.register_callback_query_handler(noop, make_filter(data, admin), state=state)
+    return dp
+
+
+def router_dispatcher(bot):
+    dp = Dispatcher(bot, storage=MemoryStorage())
+    router = CallbackRouter()
+    groups = {False: router.group(), True: router.group(lambda c: c.from_user.id == ADMIN_ID)}
+    for data, admin, state in ROUTES:
+        groups[admin].route(data.rstrip(':'), state=state)(noop)
+    router.register(dp)
+    return dp
+
+
+def make_update(data):
+    return types.Update(**{
+        'update_id': 1,
+        'callback_query': {
+            'id': '1',
+            'from': {'id': ADMIN_ID, 'is_bot': False, 'first_name': 'admin'},
+            'chat_instance': '1',
+            'data': data,
+            'message': {'message_id': 1, 'date': 0, 'chat': {'id': ADMIN_ID, 'type': 'private'}},
+        },
+    })
+
+
+async def measure(dp, update, repeats):
+    for _ in range(100):
+        await dp.process_update(update)
+    started = time.perf_counter()
+    for _ in range(repeats):
+        await dp.process_update(update)
+    return (time.perf_counter() - started) / repeats * 1e6
+
+
+async def main(repeats):
+    bot = Bot(token='123456:benchmark')
+    dispatchers = {'filters': filter_chain_dispatcher(bot), 'router': router_dispatcher(bot)}
+    print(f"{'callback_data':<20}{'filters, мкс':>14}{'router, мкс':>14}{'ускорение':>12}")
+    for data in SAMPLES:
+        update = make_update(data)
+        old = await measure(dispatchers['filters'], update, repeats)
+        new = await measure(dispatchers['router'], update, repeats)
+        print(f"{data:<20}{old:>14.1f}{new:>14.1f}{old / new:>11.1f}x")
+    await (await bot.get_session()).close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
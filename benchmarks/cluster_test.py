@@ -0,0 +1,170 @@
+"""
+Проверка многопроцессного режима на одной машине: main.py запускается
+с BOT_MODE=webhook и WORKERS=N против поддельного Bot API из load_test.py,
+апдейты отправляются POST-запросами на вебхук.
+
+Проверяется, что:
+- все апдейты обработаны, по времени до последнего ответа считаются апдейты в секунду;
+- лимит бесплатных запросов соблюдается точно: чат всегда попадает в один воркер;
+- фраза, добавленная админом в одном воркере, сразу выдаётся всеми остальными.
+
+    python benchmarks/cluster_test.py [--workers 4] [--users 100] [--clicks 6]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import multiprocessing
+
+import aiohttp
+
+from load_test import ROOT, USER_ID_BASE, Updates, free_port, run_fake_api, wait_for_port
+
+ADMIN_ID = 42
+FREE_REQUESTS = 3
+LIMIT_TEXT = 'Вы достигли лимита'
+MARKER = 'Проверка кластера'
+
+
+async def wait_for(session, api_port, expected, timeout):
+    """Ждёт, пока счётчики поддельного API дойдут до expected; возвращает последние значения."""
+    deadline = time.monotonic() + timeout
+    while True:
+        async with session.get(f'http://127.0.0.1:{api_port}/stats') as response:
+            calls = await response.json()
+        if all(calls.get(key, 0) >= value for key, value in expected.items()) or time.monotonic() > deadline:
+            return calls
+        await asyncio.sleep(0.05)
+
+
+async def wait_ready(session, bot_port, timeout):
+    """В многопроцессном режиме /health показывает воркеры; ждём, пока все откроют базу."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        async with session.get(f'http://127.0.0.1:{bot_port}/health') as response:
+            workers = (await response.json()).get('workers', ())
+        if all(worker['ready'] for worker in workers):
+            return
+        await asyncio.sleep(0.1)
+    raise RuntimeError("Воркеры не запустились")
+
+
+async def post(session, url, payload):
+    async with session.post(url, json=payload) as response:
+        response.raise_for_status()
+
+
+async def run(args, api_port, bot_port):
+    url = f'http://127.0.0.1:{bot_port}/webhook'
+    updates = Updates()
+    users = range(USER_ID_BASE, USER_ID_BASE + 2 * args.users)
+    failures = []
+
+    async def user(user_id):
+        # Нажатия одного пользователя идут с паузой, как у живого человека
+        await post(session, url, updates.message(user_id, '/start'))
+        for _ in range(args.clicks):
+            await asyncio.sleep(args.gap)
+            await post(session, url, updates.callback(user_id, 'get_phrase'))
+
+    async with aiohttp.ClientSession() as session:
+        await wait_ready(session, bot_port, args.timeout)
+        # Подписаны чётные пользователи, нечётные упираются в лимит
+        started = time.perf_counter()
+        await asyncio.gather(*(user(user_id) for user_id in users))
+        total = 2 * args.users * (args.clicks + 1)
+        calls = await wait_for(session, api_port, {'sendMessage': 2 * args.users,
+                                                    'answerCallbackQuery': 2 * args.users * args.clicks,
+                                                    'editMessageText': 2 * args.users * args.clicks},
+                               args.timeout)
+        elapsed = time.perf_counter() - started
+        processed = calls.get('sendMessage', 0) + calls.get('answerCallbackQuery', 0)
+        print(f"Обработано {processed} из {total} апдейтов за {elapsed:.2f} с ({processed / elapsed:.0f} апд/с)")
+        if processed < total:
+            failures.append(f"обработаны не все апдейты: {processed} из {total}")
+
+        expected_limits = args.users * max(args.clicks - FREE_REQUESTS, 0)
+        if calls.get('limit', 0) != expected_limits:
+            failures.append(f"сообщений о лимите {calls.get('limit', 0)}, ожидалось {expected_limits}")
+
+        # Админ заменяет все фразы одной, после этого её должны выдавать все воркеры
+        for payload in (updates.callback(ADMIN_ID, 'confirm_delete_all'),
+                        updates.callback(ADMIN_ID, 'add_phrases'),
+                        updates.message(ADMIN_ID, MARKER),
+                        updates.callback(ADMIN_ID, 'confirm_add')):
+            await post(session, url, payload)
+            await asyncio.sleep(args.admin_gap)
+        subscribed = users[::2]
+        await asyncio.gather(*(post(session, url, updates.callback(user_id, 'get_phrase')) for user_id in subscribed))
+        calls = await wait_for(session, api_port, {'marker': len(subscribed)}, args.timeout)
+        print(f"Новую фразу получили {calls.get('marker', 0)} из {len(subscribed)} пользователей")
+        if calls.get('marker', 0) != len(subscribed):
+            failures.append("изменение фраз дошло не до всех воркеров")
+
+        async with session.get(f'http://127.0.0.1:{bot_port}/health') as response:
+            health = await response.json()
+        for worker in health.get('workers', ()):
+            print(f"Воркер {worker['index']}: апдейтов {worker['forwarded']}, перезапусков {worker['restarts']}")
+    return failures
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--users', type=int, default=100, help='подписанных и столько же неподписанных')
+    parser.add_argument('--clicks', type=int, default=6, help='нажатий «Получить фразу» на пользователя')
+    parser.add_argument('--gap', type=float, default=0.3, help='пауза между нажатиями пользователя, с')
+    parser.add_argument('--admin-gap', type=float, default=1, help='пауза между шагами админа, с')
+    parser.add_argument('--latency', type=float, default=20, help='задержка ответа Bot API, мс')
+    parser.add_argument('--timeout', type=float, default=60)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix='bot-cluster-')
+    shutil.copy(os.path.join(ROOT, 'phrases.db'), os.path.join(workdir, 'phrases.db'))
+    api_port, bot_port = free_port(), free_port()
+    server = multiprocessing.Process(target=run_fake_api, daemon=True, kwargs={
+        'port': api_port, 'latency': args.latency / 1000, 'upload_phrases': 0,
+        'track': {'limit': LIMIT_TEXT, 'marker': MARKER}})
+    server.start()
+    env = dict(os.environ, BOT_MODE='webhook', WORKERS=str(args.workers), WEBAPP_HOST='127.0.0.1',
+               WEBAPP_PORT=str(bot_port), BOT_API_SERVER=f'http://127.0.0.1:{api_port}',
+               DB_NAME=os.path.join(workdir, 'phrases.db'), FSM_SNAPSHOT='', ADMIN_ID=str(ADMIN_ID),
+               FREE_REQUESTS=str(FREE_REQUESTS), METRICS_ENABLED='', API_GLOBAL_RATE='1000000',
+               API_CHAT_RATE='1000000', API_CHAT_BURST='1000000')
+    env.pop('WEBHOOK_URL', None)
+    bot = subprocess.Popen([sys.executable, os.path.join(ROOT, 'main.py')], cwd=workdir, env=env,
+                           stdout=subprocess.DEVNULL, stderr=open(os.path.join(workdir, 'bot.log'), 'w'))
+    failures = []
+    try:
+        wait_for_port(api_port)
+        wait_for_port(bot_port, timeout=30)
+        failures = asyncio.run(run(args, api_port, bot_port))
+    finally:
+        bot.send_signal(signal.SIGTERM)
+        try:
+            bot.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+            failures.append('бот не остановился по SIGTERM')
+        server.terminate()
+        with open(os.path.join(workdir, 'bot.log')) as log:
+            errors = [line for line in log if 'ERROR' in line or 'Traceback' in line]
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for line in errors[:20]:
+        print(line.rstrip())
+    for line in failures:
+        print(f"Ошибка: {line}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,406 @@
+"""
+Нагрузочный тест бота: настоящие обработчики из main.py против локального
+поддельного Bot API с задержкой ответа. Прогоняет синтетические потоки
+апдейтов и печатает p50/p99 времени обработки, апдейты в секунду, время в
+базе и рост памяти по сценариям.
+
+    python benchmarks/load_test.py [--users 200] [--clicks 10] [--latency 20]
+    python benchmarks/load_test.py --save-baseline
+
+Результат сравнивается с benchmarks/load_test_baseline.json; при регрессии
+больше --tolerance скрипт завершается с кодом 1. Базовые цифры зависят от
+машины, поэтому после смены железа baseline нужно снять заново.
+Работает на копии phrases.db во временном каталоге.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import socket
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, 'benchmarks', 'load_test_baseline.json')
+USER_ID_BASE = 10_000_000
+SCENARIOS = ('phrases', 'subscription', 'admin', 'upload')
+
+sys.path.insert(0, ROOT)
+
+
+# --- Поддельный Bot API, работает в отдельном процессе ---
+
+def run_fake_api(port, latency, upload_phrases, track=None, blocked_every=0, count_chats=False):
+    """
+    track — {счётчик: префикс}: сколько отправленных текстов начинается с префикса.
+    blocked_every — чаты с id, кратным ему, «заблокировали бота» и получают 403 на sendMessage.
+    count_chats — счётчик chats: сколько разных чатов получили sendMessage.
+    """
+    from aiohttp import web
+
+    message_ids = itertools.count(1000)
+    calls = {}
+    chats = set()
+
+    def message(chat_id, **extra):
+        chat_id = int(chat_id or 0)
+        return dict({'message_id': next(message_ids), 'date': int(time.time()),
+                     'chat': {'id': chat_id, 'type': 'private'}}, **extra)
+
+    async def method(request):
+        name = request.match_info['method']
+        form = await request.post()
+        calls[name] = calls.get(name, 0) + 1
+        for counter, prefix in (track or {}).items():
+            if form.get('text', '').startswith(prefix):
+                calls[counter] = calls.get(counter, 0) + 1
+        chat_id = form.get('chat_id')
+        if name == 'sendMessage' and blocked_every and int(chat_id) % blocked_every == 0:
+            calls['blocked'] = calls.get('blocked', 0) + 1
+            return web.json_response({'ok': False, 'error_code': 403,
+                                      'description': 'Forbidden: bot was blocked by the user'}, status=403)
+        if name == 'sendMessage' and count_chats:
+            chats.add(chat_id)
+            calls['chats'] = len(chats)
+        if latency:
+            await asyncio.sleep(latency)
+        if name in ('sendMessage', 'editMessageText'):
+            result = message(chat_id, text=form.get('text', ''))
+        elif name == 'sendDocument':
+            result = message(chat_id, document={'file_id': 'doc', 'file_unique_id': 'doc'})
+        elif name == 'getChatMember':
+            # Чётные пользователи подписаны на канал, нечётные — нет
+            user_id = int(form.get('user_id'))
+            result = {'status': 'member' if user_id % 2 == 0 else 'left',
+                      'user': {'id': user_id, 'is_bot': False, 'first_name': 'user'}}
+        elif name == 'getFile':
+            result = {'file_id': form.get('file_id'), 'file_unique_id': form.get('file_id'),
+                      'file_path': f"documents/{form.get('file_id')}.txt"}
+        elif name == 'getUpdates':
+            result = []
+        elif name == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bot', 'username': 'bot'}
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def file(request):
+        calls['file'] = calls.get('file', 0) + 1
+        name = request.match_info['path'].rsplit('/', 1)[-1]
+        body = '\n'.join(f'"Фраза из файла {name} номер {i}"' for i in range(upload_phrases))
+        return web.Response(body=body.encode('utf-8'))
+
+    async def stats(request):
+        return web.json_response(calls)
+
+    app = web.Application()
+    app.router.add_get('/stats', stats)
+    app.router.add_get('/file/bot{token}/{path:.+}', file)
+    app.router.add_post('/bot{token}/{method}', method)
+    web.run_app(app, host='127.0.0.1', port=port, print=None, handle_signals=False)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Поддельный Bot API не поднялся на порту {port}")
+
+
+# --- Синтетические апдейты ---
+
+class Updates:
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}
+
+    def message(self, user_id, text=None, document=None):
+        message = {'message_id': next(self._ids), 'date': int(time.time()),
+                   'chat': {'id': user_id, 'type': 'private'}, 'from': self._user(user_id)}
+        if text is not None:
+            message['text'] = text
+            if text.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        if document is not None:
+            message['document'] = document
+        return {'update_id': next(self._ids), 'message': message}
+
+    def callback(self, user_id, data, message_id=1):
+        return {'update_id': next(self._ids), 'callback_query': {
+            'id': str(next(self._ids)),
+            'from': self._user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {'message_id': message_id, 'date': int(time.time()),
+                        'chat': {'id': user_id, 'type': 'private'}},
+        }}
+
+    def document(self, user_id, name):
+        return self.message(user_id, document={'file_id': name, 'file_unique_id': name,
+                                               'file_name': f'{name}.txt'})
+
+
+def user_streams(updates, first_id, users, clicks, extra=()):
+    """Поток на пользователя: /start, потом clicks нажатий «Получить фразу»."""
+    streams = []
+    for user_id in range(first_id, first_id + 2 * users, 2):
+        stream = [updates.message(user_id, '/start')]
+        stream += [updates.callback(user_id, 'get_phrase') for _ in range(clicks)]
+        stream += [updates.callback(user_id, data) for data in extra]
+        streams.append(stream)
+    return streams
+
+
+async def admin_streams(main, updates, rounds, pages):
+    ids = [row[0] for row in await main.db.fetchall('SELECT id FROM phrases ORDER BY id')]
+    cursors = ids[2::3][:pages]
+    stream = []
+    for _ in range(rounds):
+        stream += [updates.callback(main.ADMIN_ID, data) for data in
+                   ('admin_panel', 'delete_phrases', 'select_delete_phrases')]
+        stream += [updates.callback(main.ADMIN_ID, f'nav_delete:>{cursor}') for cursor in cursors]
+        stream += [updates.callback(main.ADMIN_ID, f'nav_delete:<{cursor}') for cursor in reversed(cursors)]
+        stream.append(updates.callback(main.ADMIN_ID, 'list_phrases'))
+    return [stream]
+
+
+def upload_streams(main, updates, uploads):
+    stream = []
+    for number in range(uploads):
+        stream.append(updates.callback(main.ADMIN_ID, 'upload_phrases'))
+        stream.append(updates.document(main.ADMIN_ID, f'upload{os.getpid()}_{time.time_ns()}_{number}'))
+    return [stream]
+
+
+# --- Замеры ---
+
+def rss_kb():
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class DBTimer:
+    """
+    Подменяет read/write у Database и суммирует время удержания соединения.
+    Ожидание свободного соединения не считается — оно зависит от конкурентности.
+    """
+
+    def __init__(self, db):
+        self.seconds = 0.0
+        self.operations = 0
+        read, write = db.read, db.write
+        db.read = self._timed(read)
+        db.write = self._timed(write)
+
+    def _timed(self, context):
+        @asynccontextmanager
+        async def timed():
+            async with context() as conn:
+                started = time.perf_counter()
+                try:
+                    yield conn
+                finally:
+                    self.seconds += time.perf_counter() - started
+                    self.operations += 1
+        return timed
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def replay(dp, streams, concurrency):
+    from aiogram import types
+
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(stream):
+        # Апдейты одного пользователя идут по порядку, как у живого человека
+        async with semaphore:
+            for payload in stream:
+                update = types.Update(**payload)
+                started = time.perf_counter()
+                await dp.process_update(update)
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run(stream) for stream in streams))
+    return latencies, time.perf_counter() - started
+
+
+async def api_calls(session, port):
+    async with session.get(f'http://127.0.0.1:{port}/stats') as response:
+        return await response.json()
+
+
+async def run_scenarios(args, port):
+    import aiohttp
+    from aiogram import Bot, Dispatcher
+    from aiogram.bot.api import TelegramAPIServer
+    import main
+
+    # Логи обработчиков на каждый апдейт исказят замер
+    logging.getLogger().setLevel(logging.WARNING)
+    main.bot.server = TelegramAPIServer.from_base(f'http://127.0.0.1:{port}')
+    Bot.set_current(main.bot)
+    Dispatcher.set_current(main.dp)
+    timer = DBTimer(main.db)
+    updates = Updates()
+    results = {}
+
+    await main.on_startup(main.dp)
+    async with aiohttp.ClientSession() as session:
+        for name in args.scenarios:
+            if name == 'phrases':
+                streams = user_streams(updates, USER_ID_BASE, args.users, args.clicks)
+            elif name == 'subscription':
+                # Нечётные пользователи не подписаны: упираются в лимит и жмут «Я подписался»
+                streams = user_streams(updates, USER_ID_BASE + 1, args.users, main.FREE_REQUESTS + 2,
+                                       extra=('check_subscription',))
+            elif name == 'admin':
+                streams = await admin_streams(main, updates, args.admin_rounds, args.pages)
+            else:
+                streams = upload_streams(main, updates, args.uploads)
+
+            calls_before = await api_calls(session, port)
+            db_seconds, db_operations = timer.seconds, timer.operations
+            rss_before = rss_kb()
+            latencies, elapsed = await replay(main.dp, streams, args.concurrency)
+            calls_after = await api_calls(session, port)
+            latencies.sort()
+            results[name] = {
+                'updates': len(latencies),
+                'seconds': round(elapsed, 3),
+                'updates_per_sec': round(len(latencies) / elapsed, 1),
+                'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+                'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+                'max_ms': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+                'db_ms_per_update': round((timer.seconds - db_seconds) * 1000 / max(len(latencies), 1), 3),
+                'db_operations': timer.operations - db_operations,
+                'api_calls': sum(calls_after.values()) - sum(calls_before.values()),
+                'rss_growth_kb': rss_kb() - rss_before,
+            }
+    await main.on_shutdown(main.dp)
+    await (await main.bot.get_session()).close()
+    return results
+
+
+# --- Отчёт и baseline ---
+
+COLUMNS = (
+    ('updates', 'апдейтов'), ('updates_per_sec', 'апд/с'), ('p50_ms', 'p50, мс'), ('p99_ms', 'p99, мс'),
+    ('db_ms_per_update', 'БД, мс/апд'), ('api_calls', 'вызовов API'), ('rss_growth_kb', 'RSS, КБ'),
+)
+# Метрика и направление: 1 — больше лучше, -1 — меньше лучше
+CHECKS = (('updates_per_sec', 1), ('p50_ms', -1), ('p99_ms', -1), ('db_ms_per_update', -1))
+
+
+def print_report(results):
+    print(f"{'сценарий':<14}" + ''.join(f'{title:>14}' for _, title in COLUMNS))
+    for name, metrics in results.items():
+        print(f'{name:<14}' + ''.join(f'{metrics[key]:>14}' for key, _ in COLUMNS))
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, metrics in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for key, direction in CHECKS:
+            old, new = base.get(key), metrics.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * direction
+            if change < -tolerance:
+                regressions.append(f"{name}.{key}: {old} -> {new} ({-change:.0%} хуже)")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200, help='пользователей в пользовательских сценариях')
+    parser.add_argument('--clicks', type=int, default=10, help='нажатий «Получить фразу» на пользователя')
+    parser.add_argument('--concurrency', type=int, default=100, help='пользователей одновременно')
+    parser.add_argument('--latency', type=float, default=20, help='задержка ответа Bot API, мс')
+    parser.add_argument('--admin-rounds', type=int, default=20)
+    parser.add_argument('--pages', type=int, default=10, help='страниц удаления за раунд')
+    parser.add_argument('--uploads', type=int, default=3)
+    parser.add_argument('--upload-phrases', type=int, default=5000, help='фраз в загружаемом файле')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--rate-limits', action='store_true',
+                        help='оставить лимиты Telegram в OutboundScheduler (иначе меряются только обработчики)')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='допустимое ухудшение, доля')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix='bot-load-')
+    shutil.copy(os.path.join(ROOT, 'phrases.db'), os.path.join(workdir, 'phrases.db'))
+    os.environ['DB_NAME'] = os.path.join(workdir, 'phrases.db')
+    os.environ['FSM_SNAPSHOT'] = ''
+    if not args.rate_limits:
+        os.environ['API_GLOBAL_RATE'] = os.environ['API_CHAT_RATE'] = os.environ['API_CHAT_BURST'] = '1000000'
+
+    port = free_port()
+    server = multiprocessing.Process(target=run_fake_api, args=(port, args.latency / 1000, args.upload_phrases),
+                                     daemon=True)
+    server.start()
+    try:
+        wait_for_port(port)
+        results = asyncio.run(run_scenarios(args, port))
+    finally:
+        server.terminate()
+        server.join()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(results)
+    params = {key: getattr(args, key) for key in ('users', 'clicks', 'concurrency', 'latency', 'admin_rounds',
+                                                  'pages', 'uploads', 'upload_phrases', 'rate_limits')}
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as file:
+            json.dump({'params': params, 'results': results}, file, ensure_ascii=False, indent=2)
+        print(f"Baseline сохранён в {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline, encoding='utf-8') as file:
+        baseline = json.load(file)
+    if baseline.get('params') != params:
+        print("Параметры отличаются от baseline, сравнение может быть некорректным")
+    regressions = compare(results, baseline.get('results', {}), args.tolerance)
+    for line in regressions:
+        print(f"Регрессия: {line}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,341 @@
+"""
+Проверка хранилищ лимитов запросов из quota.py без внешних сервисов.
+
+- RedisQuotaStore: get/hit/reset против встроенного в процесс сервера,
+  говорящего на RESP (AUTH, SELECT, GET, SET EX NX, INCR, EXPIRE NX, DEL,
+  MULTI/EXEC), включая истечение окна, истечение ключа прямо перед INCR,
+  ошибку посреди потока, перезапуск сервера, отмену посреди команды
+  и параллельные запросы;
+- SqliteQuotaStore: счётчики переживают close()/start(), сброшенные
+  и истёкшие записи после перезапуска не возвращаются, а неудачный
+  flush не теряет ни изменений, ни удалений;
+- MemoryQuotaStore: после period записи и куча сроков вычищаются.
+
+    python benchmarks/quota_test.py [--users 10000] [--period 1]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from quota import MemoryQuotaStore, RedisError, RedisQuotaStore, SqliteQuotaStore
+
+PASSWORD = 'secret'
+
+
+class FakeRedis:
+    """Минимальный сервер RESP: ровно те команды, что использует RedisQuotaStore."""
+
+    def __init__(self, password=None):
+        self.password = password
+        self.databases = {}
+        self.commands = 0
+        # Ключи, которые истекут прямо перед следующим INCR по ним
+        self.expire_before_incr = set()
+        # Задержка ответов, чтобы клиента можно было отменить посреди команды
+        self.delay = 0
+        self._connections = set()
+
+    def disconnect(self):
+        """Рвёт все открытые соединения, как перезапуск Redis."""
+        for writer in self._connections:
+            writer.close()
+
+    async def serve(self, reader, writer):
+        database = self.databases.setdefault(b'0', {})
+        authorized = self.password is None
+        queued = None
+        self._connections.add(writer)
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                self.commands += 1
+                name = args[0].upper()
+                if name == b'AUTH':
+                    authorized = args[1].decode() == self.password
+                    reply = b'+OK\r\n' if authorized else b'-WRONGPASS invalid password\r\n'
+                elif not authorized:
+                    reply = b'-NOAUTH Authentication required\r\n'
+                elif name == b'SELECT':
+                    database = self.databases.setdefault(args[1], {})
+                    reply = b'+OK\r\n'
+                elif name == b'MULTI':
+                    queued = []
+                    reply = b'+OK\r\n'
+                elif name == b'EXEC':
+                    # Команды транзакции выполняются подряд, без других клиентов между ними
+                    replies = [self._execute(database, args[0].upper(), args[1:]) for args in queued or ()]
+                    reply = b'*%d\r\n' % len(replies) + b''.join(replies)
+                    queued = None
+                elif queued is not None:
+                    queued.append(args)
+                    reply = b'+QUEUED\r\n'
+                else:
+                    reply = self._execute(database, name, args[1:])
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                writer.write(reply)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    @staticmethod
+    async def _read_command(reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            size = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(size + 2))[:-2])
+        return args
+
+    @staticmethod
+    def _alive(database, key):
+        entry = database.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del database[key]
+            entry = None
+        return entry
+
+    def _execute(self, database, name, args):
+        if name == b'GET':
+            entry = self._alive(database, args[0])
+            return b'$-1\r\n' if entry is None else b'$%d\r\n%s\r\n' % (len(entry[0]), entry[0])
+        if name == b'SET':
+            key, value, options = args[0], args[1], [arg.upper() for arg in args[2:]]
+            if b'NX' in options and self._alive(database, key) is not None:
+                return b'$-1\r\n'
+            expires = None
+            if b'EX' in options:
+                expires = time.monotonic() + int(options[options.index(b'EX') + 1])
+            database[key] = [value, expires]
+            return b'+OK\r\n'
+        if name == b'INCR':
+            if args[0] in self.expire_before_incr:
+                self.expire_before_incr.discard(args[0])
+                database.pop(args[0], None)
+            entry = self._alive(database, args[0]) or database.setdefault(args[0], [b'0', None])
+            entry[0] = str(int(entry[0]) + 1).encode()
+            return b':%s\r\n' % entry[0]
+        if name == b'EXPIRE':
+            entry = self._alive(database, args[0])
+            if entry is None or (b'NX' in [arg.upper() for arg in args[2:]] and entry[1] is not None):
+                return b':0\r\n'
+            entry[1] = time.monotonic() + int(args[1])
+            return b':1\r\n'
+        if name == b'DEL':
+            return b':%d\r\n' % (database.pop(args[0], None) is not None)
+        return b"-ERR unknown command '%s'\r\n" % name
+
+
+def check(failures, condition, message):
+    if not condition:
+        failures.append(message)
+
+
+async def test_redis(args, failures):
+    server = FakeRedis(PASSWORD)
+    listener = await asyncio.start_server(server.serve, '127.0.0.1', 0)
+    port = listener.sockets[0].getsockname()[1]
+    store = RedisQuotaStore(f'redis://:{PASSWORD}@127.0.0.1:{port}/2', period=args.period)
+    await store.start()
+    try:
+        check(failures, await store.get(1) == 0, "Redis: новый пользователь с ненулевым счётчиком")
+        counts = [await store.hit(1) for _ in range(3)]
+        check(failures, counts == [1, 2, 3], f"Redis: hit вернул {counts}, ожидалось [1, 2, 3]")
+        check(failures, await store.get(1) == 3, "Redis: get после трёх hit не равен 3")
+        check(failures, b'quota:1' in server.databases.get(b'2', {}), "Redis: SELECT из адреса не применён")
+
+        await store.reset(1)
+        check(failures, await store.get(1) == 0, "Redis: reset не обнулил счётчик")
+
+        try:
+            await store.command('FLUSHALL')
+            failures.append("Redis: ошибка сервера не превратилась в RedisError")
+        except RedisError:
+            pass
+        check(failures, await store.hit(2) == 1, "Redis: после ошибки сбился поток ответов")
+
+        await store.hit(3)
+        await asyncio.sleep(args.period + 0.1)
+        check(failures, await store.get(3) == 0, "Redis: окно не истекло через period")
+        check(failures, await store.hit(3) == 1, "Redis: после истечения окна счёт начался не с 1")
+
+        # Окно истекает между проверкой срока и INCR: новый счётчик всё равно должен получить срок
+        await store.hit(5)
+        server.expire_before_incr.add(b'quota:5')
+        check(failures, await store.hit(5) == 1, "Redis: после истечения ключа счёт начался не с 1")
+        entry = server.databases[b'2'].get(b'quota:5')
+        check(failures, entry is not None and entry[1] is not None, "Redis: ключ после истечения остался без срока")
+        await asyncio.sleep(args.period + 0.1)
+        check(failures, await store.get(5) == 0, "Redis: счётчик после истечения ключа не сбросился")
+
+        # Отменённая посреди обмена команда не должна оставить свой ответ следующей
+        server.delay = 0.2
+        task = asyncio.ensure_future(store.hit(6))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        server.delay = 0
+        try:
+            check(failures, await store.get(7) == 0, "Redis: после отмены команда получила чужой ответ")
+        except Exception as e:
+            failures.append(f"Redis: после отмены команды соединение сломано: {e!r}")
+
+        # Перезапуск сервера: не больше одной неудачной команды, дальше клиент переподключается сам
+        listener.close()
+        server.disconnect()
+        await listener.wait_closed()
+        listener = await asyncio.start_server(server.serve, '127.0.0.1', port)
+        errors = 0
+        for _ in range(3):
+            try:
+                await store.get(1)
+            except Exception:
+                errors += 1
+        check(failures, errors <= 1, f"Redis: после перезапуска сервера {errors} неудачных команд из 3")
+        try:
+            check(failures, await store.hit(8) == 1, "Redis: после переподключения hit вернул не 1")
+        except Exception as e:
+            failures.append(f"Redis: клиент не переподключился: {e!r}")
+
+        started = time.perf_counter()
+        counts = await asyncio.gather(*(store.hit(4) for _ in range(args.requests)))
+        elapsed = time.perf_counter() - started
+        check(failures, sorted(counts) == list(range(1, args.requests + 1)),
+              "Redis: параллельные hit потеряли или повторили счёт")
+        print(f"Redis: {args.requests} параллельных hit за {elapsed * 1000:.0f} мс "
+              f"({args.requests / elapsed:.0f} в секунду), команд на сервере {server.commands}")
+    finally:
+        await store.close()
+        listener.close()
+        await listener.wait_closed()
+
+
+async def test_sqlite(args, failures, workdir):
+    path = os.path.join(workdir, 'quotas.db')
+    db = Database(path)
+    await db.connect()
+    # Без фоновых сохранений: в базу счётчики попадают только при close()
+    store = SqliteQuotaStore(db, flush_interval=3600, batch_size=args.users + 1)
+    await store.start()
+    for user_id in range(args.users):
+        await store.hit(user_id)
+    await store.hit(0)
+    await store.reset(1)
+    await store.close()
+
+    # Короткое окно: после перезапуска запись уже истекла
+    short = SqliteQuotaStore(db, period=args.period, flush_interval=3600)
+    await short.start()
+    await short.hit(-1)
+    await short.close()
+    await db.close()
+    await asyncio.sleep(args.period + 0.1)
+
+    db = Database(path)
+    await db.connect()
+    store = SqliteQuotaStore(db, flush_interval=3600)
+    await store.start()
+    counts = (await store.get(0), await store.get(1), await store.get(args.users - 1), await store.get(-1))
+    rows = (await db.fetchone('SELECT COUNT(*) FROM quotas'))[0]
+    await store.close()
+    await db.close()
+    print(f"SQLite: после перезапуска счётчики {counts[:3]}, записей в таблице {rows}")
+    check(failures, counts[0] == 2 and counts[2] == 1, f"SQLite: счётчики не пережили перезапуск: {counts}")
+    check(failures, counts[1] == 0, "SQLite: сброшенный счётчик вернулся после перезапуска")
+    check(failures, counts[3] == 0, "SQLite: истёкшее окно вернулось после перезапуска")
+    check(failures, rows == args.users - 1, f"SQLite: в таблице {rows} записей, ожидалось {args.users - 1}")
+
+
+async def test_sqlite_failed_flush(failures, workdir):
+    path = os.path.join(workdir, 'quotas_failed.db')
+    db = Database(path)
+    await db.connect()
+    store = SqliteQuotaStore(db, flush_interval=3600)
+    await store.start()
+    await store.hit(1)
+    await store.flush()
+    await store.hit(2)
+    await store.hit(2)
+    await store.reset(1)
+
+    def failing_write():
+        raise sqlite3.OperationalError('database is locked')
+    db.write, write = failing_write, db.write
+    try:
+        await store.flush()
+        failures.append("SQLite: подменённая ошибка записи не дошла до flush")
+    except sqlite3.OperationalError:
+        pass
+    db.write = write
+    # Сброс, не дошедший до базы, не должен подняться из неё
+    reloaded = await store.get(1)
+    await store.close()
+    await db.close()
+
+    db = Database(path)
+    await db.connect()
+    store = SqliteQuotaStore(db, flush_interval=3600)
+    await store.start()
+    counts = await store.get(1), await store.get(2)
+    await store.close()
+    await db.close()
+    print(f"SQLite: после неудачного flush и перезапуска счётчики {counts}")
+    check(failures, reloaded == 0, "SQLite: сброшенный счётчик вернулся из базы после неудачного flush")
+    check(failures, counts == (0, 2), f"SQLite: неудачный flush потерял пачку: {counts}, ожидалось (0, 2)")
+
+
+async def test_memory(args, failures):
+    store = MemoryQuotaStore(period=args.period)
+    for user_id in range(args.users):
+        await store.hit(user_id)
+    before = len(store), len(store._expiry)
+    await asyncio.sleep(args.period + 0.1)
+    count = await store.get(0)
+    after = len(store), len(store._expiry)
+    print(f"Память: записей и сроков в куче {before} -> {after} через {args.period} с")
+    check(failures, before == (args.users, args.users), f"Память: после {args.users} hit записей {before}")
+    check(failures, after == (0, 0), f"Память: после истечения окна осталось {after}")
+    check(failures, count == 0, "Память: истёкший счётчик не обнулился")
+
+
+async def run(args, workdir):
+    failures = []
+    await test_redis(args, failures)
+    await test_sqlite(args, failures, workdir)
+    await test_sqlite_failed_flush(failures, workdir)
+    await test_memory(args, failures)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=1000, help='параллельных hit в Redis')
+    parser.add_argument('--period', type=int, default=1, help='короткое окно лимита, с')
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix='bot-quota-')
+    try:
+        failures = asyncio.run(run(args, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    for line in failures:
+        print(f"Ошибка: {line}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+Бенчмарк каталога фраз на большой таблице: импорт с отсевом дубликатов по
+хэшу нормализованного текста и поиск /search через FTS5 (и через LIKE для
+сравнения). Фразы синтетические, база создаётся во временном каталоге.
+
+    python benchmarks/search.py [--rows 1000000] [--queries 200]
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import PhraseCatalog
+from database import Database
+from importer import import_phrases
+
+WORDS = ('утро', 'день', 'вечер', 'сила', 'мечта', 'путь', 'шаг', 'цель', 'свет', 'время', 'успех', 'вера',
+         'радость', 'смелость', 'труд', 'начало', 'солнце', 'ёлка', 'надежда', 'улыбка', 'дорога', 'сердце')
+SYLLABLES = ('ра', 'до', 'ми', 'ло', 'ве', 'ст', 'ка', 'но', 'ре', 'ту', 'пи', 'зо', 'ша', 'гу', 'ль', 'ён')
+# Редкие слова: каждое встречается в десятках фраз, как в живом тексте
+RARE_WORDS = tuple(''.join(random.Random(seed).choices(SYLLABLES, k=4)) for seed in range(50000))
+
+
+def make_phrase(number):
+    # Частые слова дают длинные списки совпадений, номер делает фразу уникальной
+    rng = random.Random(number)
+    return f"{' '.join(rng.choices(WORDS, k=3))} {' '.join(rng.choices(RARE_WORDS, k=3))} {number}"
+
+
+async def phrases(rows, duplicates):
+    for number in range(rows):
+        yield make_phrase(number)
+        if number % 100 < duplicates:
+            # Та же фраза в другом регистре и с лишними пробелами
+            yield '  ' + make_phrase(number).upper().replace(' ', '  ')
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def make_queries(rows, count):
+    rng = random.Random(1)
+    return {
+        'частые слова': [' '.join(rng.sample(WORDS, rng.choice((1, 2)))) for _ in range(count)],
+        'редкие слова': [' '.join(rng.sample(RARE_WORDS, rng.choice((1, 2)))) for _ in range(count)],
+        'частое + редкое': [f'{rng.choice(WORDS)} {rng.choice(RARE_WORDS)}' for _ in range(count)],
+        'начало слова': [rng.choice(WORDS + RARE_WORDS)[:rng.choice((2, 3, 4))] for _ in range(count)],
+        'номер фразы': [str(rng.randrange(rows)) for _ in range(count)],
+    }
+
+
+async def measure(catalog, queries):
+    timings = []
+    found = 0
+    for query in queries:
+        started = time.perf_counter()
+        rows, _ = await catalog.search(query)
+        timings.append((time.perf_counter() - started) * 1000)
+        found += bool(rows)
+    return timings, found
+
+
+async def run(args, path):
+    db = Database(path)
+    await db.connect()
+    await db.execute('CREATE TABLE IF NOT EXISTS phrases (id INTEGER PRIMARY KEY, text TEXT)')
+    catalog = PhraseCatalog(db)
+    await catalog.migrate()
+
+    started = time.perf_counter()
+    result = await import_phrases(db, phrases(args.rows, args.duplicates), batch_size=args.batch)
+    elapsed = time.perf_counter() - started
+    print(f"Импорт: {result.found} фраз, добавлено {result.added}, отсеяно {result.skipped} "
+          f"за {elapsed:.1f} с ({result.found / elapsed:.0f} фраз/с)")
+
+    for name, fts in (('FTS5', True), ('LIKE', False)):
+        if fts and not catalog.fts:
+            print("FTS5 недоступен")
+            continue
+        catalog.fts = fts
+        count = args.queries if fts else args.like_queries
+        print(name)
+        for kind, queries in make_queries(args.rows, count).items():
+            timings, found = await measure(catalog, queries)
+            print(f"  {kind}: {len(queries)} запросов, с результатом {found}, "
+                  f"p50 {statistics.median(timings):.2f} мс, p99 {percentile(timings, 0.99):.2f} мс, "
+                  f"макс {max(timings):.2f} мс")
+    await db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--duplicates', type=int, default=5, help='дубликатов на каждые 100 фраз')
+    parser.add_argument('--batch', type=int, default=10000)
+    parser.add_argument('--queries', type=int, default=200, help='запросов каждого вида')
+    parser.add_argument('--like-queries', type=int, default=20, help='LIKE медленный, поэтому запросов меньше')
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix='bot-search-')
+    try:
+        asyncio.run(run(args, os.path.join(workdir, 'phrases.db')))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import time
+
+from aiohttp import ClientError
+from aiogram.utils.exceptions import ChatNotFound, NetworkError, RetryAfter, Unauthorized
+
+from outbound import BACKGROUND_PRIORITY, TokenBucket, priority
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 60 * 60
+
+# То же, что next_occurrence, в SQL: ближайшее send_minute по местному времени строго позже :now.
+# После простоя бота пропущенные дни не досылаются
+NEXT_AT = '''
+    (:now + :shift) / :day * :day + send_minute * 60 - :shift
+    + CASE WHEN (:now + :shift) / :day * :day + send_minute * 60 - :shift > :now THEN 0 ELSE :day END
+'''
+
+
+def parse_times(value):
+    """'07:00,21:30' -> (420, 1290): минуты от начала суток."""
+    minutes = []
+    for item in value.split(','):
+        hours, _, rest = item.strip().partition(':')
+        minutes.append(int(hours) * 60 + int(rest or 0))
+    return tuple(sorted(set(minutes)))
+
+
+def format_minute(minute):
+    return f'{minute // 60:02d}:{minute % 60:02d}'
+
+
+def format_offset(utc_offset):
+    """180 -> 'UTC+3', 330 -> 'UTC+5:30'."""
+    hours, minutes = divmod(abs(utc_offset), 60)
+    sign = '-' if utc_offset < 0 else '+'
+    return f'UTC{sign}{hours}' + (f':{minutes:02d}' if minutes else '')
+
+
+def next_occurrence(minute, now, utc_offset=0):
+    """Ближайший момент после now, когда по местному времени (UTC + utc_offset минут) будет minute."""
+    shift = utc_offset * 60
+    local = int(now) + shift
+    at = local - local % DAY + minute * 60 - shift
+    return at if at > now else at + DAY
+
+
+class Broadcaster:
+    """
+    Ежедневная рассылка фраз подписавшимся. Подписчики и их время хранятся
+    в таблице broadcast_subscribers, следующая отправка — в next_at.
+
+    Рассылка идёт пачками: пачка помечается claimed_at и коммитится до
+    отправки, результаты записываются одной транзакцией после. Если процесс
+    упал посреди пачки, её помеченные строки при запуске не отправляются
+    повторно, а переносятся на следующий день — лучше пропустить фразу,
+    чем прислать две. Остальные подписчики досылаются как обычно.
+    Заблокировавшие бота удаляются из подписчиков. Если get_phrase вернул
+    None (фраз нет, например после удаления всех), пачка возвращается
+    в очередь без отправки и ждёт следующего опроса.
+    """
+
+    def __init__(self, db, bot, get_phrase, utc_offset=0, rate=20, batch_size=100,
+                 interval=30, max_delay=6 * 60 * 60, enabled=True):
+        self.db = db
+        self.bot = bot
+        self.get_phrase = get_phrase
+        self.utc_offset = utc_offset
+        self.rate = rate
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_delay = max_delay
+        self.enabled = enabled
+        self.sent = 0
+        self.pruned = 0
+        self.failed = 0
+        self._task = None
+        self._stopping = False
+        self._wakeup = None
+
+    async def init(self):
+        await self.db.execute('''
+            CREATE TABLE IF NOT EXISTS broadcast_subscribers
+            (user_id INTEGER PRIMARY KEY, send_minute INTEGER NOT NULL, next_at INTEGER NOT NULL,
+             claimed_at INTEGER, sent_at INTEGER)
+        ''')
+        await self.db.execute('CREATE INDEX IF NOT EXISTS idx_broadcast_next_at ON broadcast_subscribers (next_at)')
+
+    def _params(self, now, **extra):
+        return dict(extra, now=now, day=DAY, shift=self.utc_offset * 60)
+
+    # --- Подписка ---
+
+    async def subscribe(self, user_id, minute):
+        await self.db.execute('''
+            INSERT INTO broadcast_subscribers (user_id, send_minute, next_at) VALUES (?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET send_minute = excluded.send_minute, next_at = excluded.next_at
+        ''', (user_id, minute, next_occurrence(minute, time.time(), self.utc_offset)))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def unsubscribe(self, user_id):
+        _, removed = await self.db.execute('DELETE FROM broadcast_subscribers WHERE user_id = ?', (user_id,))
+        return removed > 0
+
+    async def get_minute(self, user_id):
+        """Время рассылки пользователя в минутах от начала суток или None."""
+        row = await self.db.fetchone('SELECT send_minute FROM broadcast_subscribers WHERE user_id = ?', (user_id,))
+        return row[0] if row else None
+
+    async def count(self):
+        return (await self.db.fetchone('SELECT COUNT(*) FROM broadcast_subscribers'))[0]
+
+    # --- Рассылка ---
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self, timeout=30):
+        """Даёт дописать текущую пачку, чтобы при следующем запуске не было пропусков."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Рассылка не закончила пачку за {timeout} с")
+            self._task.cancel()
+        self._task = None
+
+    async def _run(self):
+        await self.recover()
+        while not self._stopping:
+            try:
+                await self.run_due()
+            except Exception as e:
+                logger.error(f"Ошибка рассылки: {e}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def recover(self):
+        """Пачка, прерванная падением: неизвестно, кому успели отправить, поэтому никому не досылаем."""
+        _, count = await self.db.execute(f'''
+            UPDATE broadcast_subscribers SET next_at = {NEXT_AT}, claimed_at = NULL
+            WHERE claimed_at IS NOT NULL
+        ''', self._params(int(time.time())))
+        if count:
+            logger.warning(f"Рассылка была прервана: {count} подписчиков пропускают сегодняшнюю фразу")
+
+    async def run_due(self):
+        """Отправляет всем, чьё время подошло; возвращает число отправленных."""
+        sent = self.sent
+        bucket = TokenBucket(self.rate, self.batch_size)
+        while not self._stopping:
+            batch = await self._claim()
+            if not batch:
+                break
+            started = time.monotonic()
+            results = await asyncio.gather(*(self._send(user_id) for user_id in batch))
+            await self._record(batch, results)
+            if 'wait' in results:
+                # Без фраз следующая пачка тоже не уйдёт — ждём следующего опроса
+                logger.warning("Рассылка отложена: нет фраз для отправки")
+                break
+            # Не быстрее rate сообщений в секунду, остальная пропускная способность — пользователям
+            for _ in batch:
+                bucket.consume(started)
+            delay = bucket.delay(time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if self.sent > sent:
+            logger.info(f"Рассылка: отправлено {self.sent - sent}")
+        return self.sent - sent
+
+    async def _claim(self):
+        now = int(time.time())
+        async with self.db.write() as conn:
+            # Сильно опоздавшие (бот долго лежал) ждут следующего дня
+            await conn.execute(f'''
+                UPDATE broadcast_subscribers SET next_at = {NEXT_AT}
+                WHERE next_at < :stale AND claimed_at IS NULL
+            ''', self._params(now, stale=now - self.max_delay))
+            async with conn.execute('SELECT user_id FROM broadcast_subscribers WHERE next_at <= ? '
+                                    'AND claimed_at IS NULL ORDER BY next_at LIMIT ?',
+                                    (now, self.batch_size)) as cursor:
+                batch = [row[0] for row in await cursor.fetchall()]
+            await conn.executemany('UPDATE broadcast_subscribers SET claimed_at = ? WHERE user_id = ?',
+                                   [(now, user_id) for user_id in batch])
+        return batch
+
+    async def _send(self, user_id):
+        """'sent', 'skip' (до завтра), 'prune', 'retry' или 'wait' (нет фразы)."""
+        try:
+            phrase = await self.get_phrase(user_id)
+            if phrase is None:
+                return 'wait'
+            with priority(BACKGROUND_PRIORITY):
+                await self.bot.send_message(user_id, phrase)
+        except (Unauthorized, ChatNotFound):
+            return 'prune'
+        except (RetryAfter, NetworkError, ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Рассылка: не удалось отправить {user_id}, повтор позже: {e}")
+            return 'retry'
+        except Exception as e:
+            logger.error(f"Рассылка: не удалось отправить {user_id}: {e}")
+            return 'skip'
+        return 'sent'
+
+    async def _record(self, batch, results):
+        now = int(time.time())
+        done = [user_id for user_id, result in zip(batch, results) if result in ('sent', 'skip')]
+        pruned = [user_id for user_id, result in zip(batch, results) if result == 'prune']
+        retry = [user_id for user_id, result in zip(batch, results) if result == 'retry']
+        waiting = [user_id for user_id, result in zip(batch, results) if result == 'wait']
+        async with self.db.write() as conn:
+            await conn.executemany(f'''
+                UPDATE broadcast_subscribers SET next_at = {NEXT_AT}, claimed_at = NULL, sent_at = :now
+                WHERE user_id = :user_id
+            ''', [self._params(now, user_id=user_id) for user_id in done])
+            await conn.executemany('DELETE FROM broadcast_subscribers WHERE user_id = ?',
+                                   [(user_id,) for user_id in pruned])
+            # Временная ошибка: повтор через interval, время рассылки пользователя не меняется
+            await conn.executemany('UPDATE broadcast_subscribers SET next_at = ?, claimed_at = NULL '
+                                   'WHERE user_id = ?', [(now + self.interval, user_id) for user_id in retry])
+            # Нет фразы: снимаем пометку, next_at прежний — подписчик подойдёт при следующем опросе
+            await conn.executemany('UPDATE broadcast_subscribers SET claimed_at = NULL WHERE user_id = ?',
+                                   [(user_id,) for user_id in waiting])
+        self.sent += results.count('sent')
+        self.pruned += len(pruned)
+        self.failed += len(results) - results.count('sent') - len(pruned) - len(waiting)
+        if pruned:
+            logger.info(f"Рассылка: {len(pruned)} пользователей заблокировали бота и удалены из подписчиков")
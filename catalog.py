@@ -0,0 +1,143 @@
+import hashlib
+import logging
+import re
+import sqlite3
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# Дубликат по нормализованному тексту молча пропускается, rowcount == 0
+INSERT_UNIQUE = 'INSERT INTO phrases (text, norm_hash) VALUES (?, ?) ON CONFLICT(norm_hash) DO NOTHING'
+
+FTS_TABLE = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS phrases_fts USING fts5(
+        text, content='phrases', content_rowid='id', tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3')
+'''
+FTS_TRIGGERS = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS phrases_fts_insert AFTER INSERT ON phrases BEGIN
+        INSERT INTO phrases_fts (rowid, text) VALUES (new.id, new.text);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS phrases_fts_delete AFTER DELETE ON phrases BEGIN
+        INSERT INTO phrases_fts (phrases_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS phrases_fts_update AFTER UPDATE OF text ON phrases BEGIN
+        INSERT INTO phrases_fts (phrases_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        INSERT INTO phrases_fts (rowid, text) VALUES (new.id, new.text);
+    END
+    ''',
+)
+# Сначала новые фразы: по rowid FTS5 останавливается на LIMIT, а rank считал бы все совпадения
+SEARCH_FTS = 'SELECT rowid, text FROM phrases_fts WHERE phrases_fts MATCH ? ORDER BY rowid DESC LIMIT ?'
+SEARCH_LIKE = "SELECT id, text FROM phrases WHERE text LIKE ? ESCAPE '\\' ORDER BY id DESC LIMIT ?"
+
+WORD = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Текст для сравнения фраз: без учёта регистра, ё/е и лишних пробелов."""
+    text = unicodedata.normalize('NFKC', text).casefold().replace('ё', 'е')
+    return ' '.join(text.split())
+
+
+def text_hash(text):
+    digest = hashlib.blake2b(normalize(text).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def match_query(query):
+    """
+    Строка поиска в запрос FTS5: все слова обязательны, последнее может быть
+    недописанным. Префиксы вне prefix-индекса FTS5 собирает из всех
+    подходящих слов, поэтому префиксным делается только последнее и только
+    от двух букв: inline-запрос приходит на каждую набранную букву.
+    """
+    words = WORD.findall(query)
+    if not words:
+        return None
+    query = ' '.join(f'"{word}"' for word in words)
+    return query + '*' if len(words[-1]) > 1 else query
+
+
+class PhraseCatalog:
+    """
+    Схема таблицы phrases для поиска и защиты от дубликатов: хэш нормализованного
+    текста под уникальным индексом и полнотекстовый индекс FTS5, который
+    триггеры держат в согласии с таблицей. Без FTS5 поиск идёт через LIKE.
+    """
+
+    def __init__(self, db, batch_size=10000):
+        self.db = db
+        self.batch_size = batch_size
+        self.fts = False
+
+    async def migrate(self):
+        columns = [row[1] for row in await self.db.fetchall('PRAGMA table_info(phrases)')]
+        if 'norm_hash' not in columns:
+            try:
+                await self.db.execute('ALTER TABLE phrases ADD COLUMN norm_hash INTEGER')
+            except sqlite3.OperationalError as e:
+                # Колонку успел добавить соседний воркер
+                if 'duplicate column' not in str(e):
+                    raise
+        # Индекс до заполнения: повторный хэш не даст UPDATE OR IGNORE записать дубликат
+        await self.db.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_phrases_norm_hash ON phrases (norm_hash)')
+        await self.db.execute('DROP INDEX IF EXISTS idx_phrases_text')
+        await self._fill_hashes()
+        self.fts = await self._create_fts()
+
+    async def _fill_hashes(self):
+        filled = duplicates = 0
+        async with self.db.write() as conn:
+            last_id = 0
+            while True:
+                async with conn.execute('SELECT id, text FROM phrases WHERE norm_hash IS NULL AND id > ? '
+                                        'ORDER BY id LIMIT ?', (last_id, self.batch_size)) as cursor:
+                    rows = await cursor.fetchall()
+                if not rows:
+                    break
+                cursor = await conn.executemany('UPDATE OR IGNORE phrases SET norm_hash = ? WHERE id = ?',
+                                                [(text_hash(text), phrase_id) for phrase_id, text in rows])
+                filled += cursor.rowcount
+                duplicates += len(rows) - cursor.rowcount
+                last_id = rows[-1][0]
+        if filled:
+            logger.info(f"Посчитаны хэши для {filled} фраз")
+        if duplicates:
+            logger.warning(f"{duplicates} фраз повторяют другие и остались без хэша, их можно найти и удалить")
+
+    async def _create_fts(self):
+        exists = await self.db.fetchone("SELECT 1 FROM sqlite_master WHERE name = 'phrases_fts'")
+        try:
+            async with self.db.write() as conn:
+                if not exists:
+                    await conn.execute(FTS_TABLE)
+                for trigger in FTS_TRIGGERS:
+                    await conn.execute(trigger)
+                if not exists:
+                    await conn.execute("INSERT INTO phrases_fts (phrases_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError as e:
+            logger.warning(f"FTS5 недоступен, поиск фраз будет через LIKE: {e}")
+            return False
+        if not exists:
+            logger.info("Создан полнотекстовый индекс фраз")
+        return True
+
+    async def search(self, query, limit=10):
+        """Возвращает (rows, has_more): не больше limit совпадений, сначала новые."""
+        if self.fts:
+            match = match_query(query)
+            if match is None:
+                return [], False
+            rows = await self.db.fetchall(SEARCH_FTS, (match, limit + 1))
+        else:
+            pattern = query.strip().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            if not pattern:
+                return [], False
+            rows = await self.db.fetchall(SEARCH_LIKE, (f'%{pattern}%', limit + 1))
+        return rows[:limit], len(rows) > limit
@@ -0,0 +1,303 @@
+import asyncio
+import functools
+import json
+import logging
+import multiprocessing
+import signal
+import socket
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+
+from webhook import secret_token_middleware
+
+logger = logging.getLogger(__name__)
+
+POLL_TIMEOUT = 20
+# Апдейт может быть больше стандартных 64 КБ на строку StreamReader
+LINE_LIMIT = 2 ** 22
+
+
+def shard_key(update):
+    """chat_id апдейта, а если чата нет (inline-запрос) — id пользователя."""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        message = value.get('message')
+        if isinstance(message, dict) and 'chat' in message:
+            return message['chat']['id']
+        if 'chat' in value:
+            return value['chat']['id']
+        if 'from' in value:
+            return value['from']['id']
+    return 0
+
+
+def encode(message):
+    return json.dumps(message, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+class WorkerHandle:
+    """Процесс-воркер на стороне фронта: очередь апдейтов и перезапуск при падении."""
+
+    def __init__(self, cluster, index, target, queue_size):
+        self.cluster = cluster
+        self.index = index
+        self.target = target
+        self.queue = asyncio.Queue(queue_size)
+        self.process = None
+        self.forwarded = 0
+        self.restarts = 0
+        self.ready = False
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(encode(message))
+        except asyncio.QueueFull:
+            logger.warning(f"Очередь воркера {self.index} переполнена, апдейт отброшен")
+
+    async def _send(self, writer):
+        while True:
+            line = await self.queue.get()
+            writer.write(line)
+            await writer.drain()
+            self.forwarded += 1
+
+    async def run(self):
+        context = multiprocessing.get_context('spawn')
+        while True:
+            parent, child = socket.socketpair()
+            self.process = context.Process(target=self.target, args=(self.index, child), daemon=True,
+                                           name=f'worker-{self.index}')
+            self.process.start()
+            child.close()
+            reader, writer = await asyncio.open_connection(sock=parent, limit=LINE_LIMIT)
+            sender = None
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    message = json.loads(line)
+                    if message.get('type') == 'event':
+                        self.cluster.broadcast(message, exclude=self)
+                    elif message.get('type') == 'ready':
+                        # Пока воркер открывает базу, апдейты копятся в очереди фронта
+                        self.ready = True
+                        sender = asyncio.ensure_future(self._send(writer))
+            finally:
+                self.ready = False
+                if sender is not None:
+                    sender.cancel()
+                writer.close()
+            await asyncio.get_event_loop().run_in_executor(None, self.process.join)
+            if self.cluster.stopping:
+                return
+            self.restarts += 1
+            logger.error(f"Воркер {self.index} завершился с кодом {self.process.exitcode}, перезапуск")
+            await asyncio.sleep(1)
+
+    def stop(self):
+        self.put({'type': 'stop'})
+
+
+class Cluster:
+    """
+    Несколько процессов-воркеров за одним фронтом. Фронт получает апдейты
+    (polling или webhook) и раскладывает их по воркерам по chat_id, так что
+    чат всегда обрабатывается одним процессом. События вроде изменения фраз
+    воркер публикует через фронт всем остальным.
+    С workers=1 бот работает в одном процессе, publish ничего не делает.
+    """
+
+    def __init__(self, workers=1, queue_size=10000):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.worker_index = None
+        self.stopping = False
+        self._handles = []
+        self._subscribers = {}
+        self._writer = None
+
+    @property
+    def enabled(self):
+        return self.workers > 1
+
+    # --- События между воркерами ---
+
+    def subscribe(self, event, handler):
+        self._subscribers.setdefault(event, []).append(handler)
+
+    def publish(self, event, **data):
+        """Данные события передаются обработчикам остальных воркеров именованными аргументами."""
+        if self._writer is not None:
+            self._writer.write(encode({'type': 'event', 'event': event, 'data': data}))
+
+    async def _notify(self, event, data):
+        for handler in self._subscribers.get(event, ()):
+            try:
+                await handler(**data)
+            except Exception as e:
+                logger.error(f"Ошибка обработки события {event}: {e}")
+
+    # --- Фронт ---
+
+    def broadcast(self, message, exclude=None):
+        for handle in self._handles:
+            if handle is not exclude:
+                handle.put(message)
+
+    def dispatch(self, update):
+        self._handles[shard_key(update) % self.workers].put({'type': 'update', 'update': update})
+
+    def stats(self):
+        return {'workers': [{'index': handle.index, 'ready': handle.ready, 'queue': handle.queue.qsize(),
+                             'forwarded': handle.forwarded, 'restarts': handle.restarts}
+                            for handle in self._handles]}
+
+    async def _start_workers(self, target):
+        self._handles = [WorkerHandle(self, index, target, self.queue_size) for index in range(self.workers)]
+        return [asyncio.ensure_future(handle.run()) for handle in self._handles]
+
+    async def _stop_workers(self, tasks, timeout):
+        self.stopping = True
+        for handle in self._handles:
+            handle.stop()
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        for handle in self._handles:
+            if handle.process is not None and handle.process.is_alive():
+                logger.warning(f"Воркер {handle.index} не остановился за {timeout} с")
+                handle.process.terminate()
+        if pending:
+            await asyncio.wait(pending, timeout=5)
+
+    async def _poll(self, bot, stop):
+        offset = None
+        while not stop.is_set():
+            payload = {'timeout': POLL_TIMEOUT}
+            if offset is not None:
+                payload['offset'] = offset
+            try:
+                with bot.request_timeout(POLL_TIMEOUT + 10):
+                    updates = await bot.request('getUpdates', payload)
+            except Exception as e:
+                logger.error(f"Ошибка получения апдейтов: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                offset = update['update_id'] + 1
+                self.dispatch(update)
+
+    def run_polling(self, bot, target, skip_updates=True, drain_timeout=30):
+        """target(index, sock) — функция уровня модуля, которая запускает воркер (см. serve_worker)."""
+        async def main():
+            stop = asyncio.Event()
+            loop = asyncio.get_event_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, stop.set)
+            tasks = await self._start_workers(target)
+            await bot.delete_webhook(drop_pending_updates=skip_updates)
+            logger.info(f"Polling запущен, воркеров: {self.workers}")
+            poller = asyncio.ensure_future(self._poll(bot, stop))
+            await stop.wait()
+            poller.cancel()
+            await self._stop_workers(tasks, drain_timeout)
+            await (await bot.get_session()).close()
+
+        asyncio.run(main())
+
+    def run_webhook(self, bot, target, webhook_path, host, port, webhook_url=None, secret=None, skip_updates=True,
+                    drain_timeout=30):
+        app = web.Application(middlewares=[secret_token_middleware(secret, webhook_path)] if secret else [])
+        tasks = []
+
+        async def receive(request):
+            self.dispatch(await request.json())
+            return web.Response()
+
+        async def health(request):
+            return web.json_response(dict(status='ok', **self.stats()))
+
+        async def startup(_):
+            tasks.extend(await self._start_workers(target))
+            if webhook_url:
+                await bot.set_webhook(webhook_url + webhook_path, secret_token=secret,
+                                      drop_pending_updates=skip_updates)
+                logger.info(f"Webhook установлен: {webhook_url}{webhook_path}")
+
+        async def shutdown(_):
+            await self._stop_workers(tasks, drain_timeout)
+            await (await bot.get_session()).close()
+
+        app.router.add_post(webhook_path, receive)
+        app.router.add_get('/health', health)
+        app.on_startup.append(startup)
+        app.on_shutdown.append(shutdown)
+        web.run_app(app, host=host, port=port)
+
+    # --- Воркер ---
+
+    def serve_worker(self, index, sock, dp, on_startup=None, on_shutdown=None, drain_timeout=30):
+        """Цикл воркера: апдейты из сокета в dp, пока фронт не пришлёт stop."""
+        # Ctrl+C получает вся группа процессов, останавливает воркеры фронт
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        self.worker_index = index
+
+        async def main():
+            Bot.set_current(dp.bot)
+            Dispatcher.set_current(dp)
+            reader, self._writer = await asyncio.open_connection(sock=sock, limit=LINE_LIMIT)
+            inflight = set()
+            chains = {}
+            events = None
+
+            async def process(raw, previous):
+                # Апдейты одного чата идут строго по очереди: лимиты и FSM не гоняются
+                if previous is not None:
+                    await asyncio.wait([previous])
+                await dp.process_update(types.Update(**raw))
+
+            async def notify(message, previous):
+                # События по порядку, но вне цикла чтения: апдейты не ждут их обработки
+                if previous is not None:
+                    await asyncio.wait([previous])
+                await self._notify(message['event'], message.get('data') or {})
+
+            def release(key, task):
+                inflight.discard(task)
+                if chains.get(key) is task:
+                    del chains[key]
+            if on_startup is not None:
+                await on_startup(dp)
+            self._writer.write(encode({'type': 'ready'}))
+            logger.info(f"Воркер {index} запущен")
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    message = json.loads(line)
+                    kind = message.get('type')
+                    if kind == 'update':
+                        key = shard_key(message['update'])
+                        task = asyncio.ensure_future(process(message['update'], chains.get(key)))
+                        chains[key] = task
+                        inflight.add(task)
+                        task.add_done_callback(functools.partial(release, key))
+                    elif kind == 'event':
+                        events = asyncio.ensure_future(notify(message, events))
+                        inflight.add(events)
+                        events.add_done_callback(inflight.discard)
+                    elif kind == 'stop':
+                        break
+            finally:
+                if inflight:
+                    await asyncio.wait(inflight, timeout=drain_timeout)
+                if on_shutdown is not None:
+                    await on_shutdown(dp)
+                await dp.storage.close()
+                await dp.storage.wait_closed()
+                await (await dp.bot.get_session()).close()
+                self._writer.close()
+
+        asyncio.run(main())
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+# Общие настройки для всех соединений
+PRAGMAS = (
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-16000',
+    'PRAGMA mmap_size=134217728',
+    'PRAGMA busy_timeout=5000',
+)
+
+
+class Database:
+    """
+    Долгоживущие соединения с SQLite: одно пишущее и небольшой пул читающих.
+    Открывается в on_startup и закрывается в on_shutdown.
+    """
+
+    def __init__(self, path, readers=4, cached_statements=256):
+        self.path = path
+        self.readers = readers
+        self.cached_statements = cached_statements
+        self._writer = None
+        self._write_lock = None
+        self._pool = None
+        self._connections = []
+
+    async def _open(self, read_only=False):
+        # cached_statements — кэш подготовленных выражений sqlite3,
+        # поэтому все запросы передаются неизменными строками
+        conn = await aiosqlite.connect(self.path, cached_statements=self.cached_statements)
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        if read_only:
+            await conn.execute('PRAGMA query_only=ON')
+        self._connections.append(conn)
+        return conn
+
+    async def connect(self):
+        if self._writer is not None:
+            return
+        self._write_lock = asyncio.Lock()
+        self._pool = asyncio.Queue()
+        self._writer = await self._open()
+        async with self._writer.execute('PRAGMA journal_mode=WAL') as cursor:
+            mode = (await cursor.fetchone())[0]
+        if mode.lower() != 'wal':
+            logger.warning(f"Не удалось включить WAL, используется режим {mode}")
+        for _ in range(self.readers):
+            self._pool.put_nowait(await self._open(read_only=True))
+        logger.info(f"База данных {self.path} открыта: 1 writer, {self.readers} readers")
+
+    async def close(self):
+        if self._writer is None:
+            return
+        async with self._write_lock:
+            for conn in self._connections:
+                await conn.close()
+        self._connections.clear()
+        self._writer = None
+        self._pool = None
+
+    @asynccontextmanager
+    async def write(self):
+        """Единственное пишущее соединение; коммит при выходе, откат при ошибке."""
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            else:
+                await self._writer.commit()
+
+    @asynccontextmanager
+    async def read(self):
+        conn = await self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put_nowait(conn)
+
+    async def execute(self, sql, parameters=()):
+        async with self.write() as conn:
+            async with conn.execute(sql, parameters) as cursor:
+                return cursor.lastrowid, cursor.rowcount
+
+    async def fetchone(self, sql, parameters=()):
+        async with self.read() as conn:
+            async with conn.execute(sql, parameters) as cursor:
+                return await cursor.fetchone()
+
+    async def fetchall(self, sql, parameters=()):
+        async with self.read() as conn:
+            async with conn.execute(sql, parameters) as cursor:
+                return await cursor.fetchall()
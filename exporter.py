@@ -0,0 +1,95 @@
+import asyncio
+import tempfile
+import time
+
+from aiogram.types import InputFile
+from aiogram.utils.exceptions import RetryAfter
+
+MESSAGE_LIMIT = 4096
+
+
+async def iter_phrase_rows(db, batch_size=500):
+    """Строки phrases по порядку id, пачками по keyset — соединение не держится между пачками."""
+    last_id = 0
+    while True:
+        rows = await db.fetchall('SELECT id, text FROM phrases WHERE id > ? ORDER BY id LIMIT ?',
+                                 (last_id, batch_size))
+        if not rows:
+            return
+        for row in rows:
+            yield row
+        last_id = rows[-1][0]
+
+
+async def iter_numbered_lines(rows):
+    number = 0
+    async for _, text in rows:
+        number += 1
+        yield f"{number}. {text}"
+
+
+async def iter_quoted_lines(rows):
+    """Формат файла загрузки, чтобы выгрузку можно было загрузить обратно."""
+    async for _, text in rows:
+        yield f'"{text}",'
+
+
+async def pack_messages(lines, header=None, limit=MESSAGE_LIMIT):
+    """
+    Склеивает строки в сообщения не длиннее limit символов, не разрывая строки.
+    Разрезается только строка, которая сама длиннее limit.
+    """
+    parts = []
+    size = 0
+    if header is not None:
+        parts.append(header)
+        size = len(header)
+    async for line in lines:
+        extra = len(line) + (1 if parts else 0)
+        if parts and size + extra > limit:
+            yield '\n'.join(parts)
+            parts = []
+            size = 0
+            extra = len(line)
+        while len(line) > limit:
+            yield line[:limit]
+            line = line[limit:]
+            extra = len(line)
+        parts.append(line)
+        size += extra
+    if parts:
+        yield '\n'.join(parts)
+
+
+class ThrottledSender:
+    """Отправка серии сообщений в один чат не чаще раза в interval секунд."""
+
+    def __init__(self, bot, chat_id, interval=1.0):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.interval = interval
+        self._last_sent = 0.0
+
+    async def send(self, text, **kwargs):
+        while True:
+            delay = self._last_sent + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                message = await self.bot.send_message(self.chat_id, text, **kwargs)
+            except RetryAfter as e:
+                self._last_sent = time.monotonic() + e.timeout
+                continue
+            self._last_sent = time.monotonic()
+            return message
+
+
+async def send_document(bot, chat_id, lines, filename='phrases.txt', caption=None, reply_markup=None):
+    """Пишет строки во временный файл и отправляет его документом."""
+    with tempfile.TemporaryFile() as file:
+        async for line in lines:
+            file.write(line.encode('utf-8'))
+            file.write(b'\n')
+        file.seek(0)
+        return await bot.send_document(chat_id, InputFile(file, filename=filename), caption=caption,
+                                       reply_markup=reply_markup)
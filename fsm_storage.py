@@ -0,0 +1,267 @@
+import asyncio
+import copy
+import json
+import logging
+import time
+import typing
+from collections import OrderedDict
+
+from aiogram.dispatcher.storage import BaseStorage
+
+logger = logging.getLogger(__name__)
+
+
+class FSMRecord:
+    __slots__ = ('state', 'data', 'bucket', 'touched')
+
+    def __init__(self, state=None, data=None, bucket=None):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.bucket = bucket if bucket is not None else {}
+        self.touched = time.monotonic()
+
+    def is_empty(self):
+        return self.state is None and not self.data and not self.bucket
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM в SQLite. Горячие записи лежат в LRU-кэше и выселяются после
+    idle_ttl секунд простоя; изменения пишутся в базу пачкой раз в flush_interval.
+    Данные переживают перезапуск бота.
+    """
+
+    def __init__(self, db, maxsize=10000, idle_ttl=3600, flush_interval=2):
+        self.db = db
+        self.maxsize = maxsize
+        self.idle_ttl = idle_ttl
+        self.flush_interval = flush_interval
+        self._cache = OrderedDict()
+        self._dirty = {}
+        # Записи, которые сейчас сохраняет flush: до коммита в базе их ещё нет
+        self._flushing = {}
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._closed = False
+
+    async def start(self):
+        await self.db.execute('''
+            CREATE TABLE IF NOT EXISTS fsm
+            (chat TEXT NOT NULL, user TEXT NOT NULL, state TEXT, data TEXT, bucket TEXT,
+             PRIMARY KEY (chat, user))
+        ''')
+        self._closed = False
+        self._task = asyncio.ensure_future(self._flush_loop())
+
+    @property
+    def cache_size(self):
+        return len(self._cache)
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        self._cache.clear()
+
+    async def wait_closed(self):
+        pass
+
+    def _evict(self):
+        deadline = time.monotonic() - self.idle_ttl
+        cache = self._cache
+        while cache:
+            key, record = next(iter(cache.items()))
+            if len(cache) <= self.maxsize and record.touched > deadline:
+                break
+            # Несохранённая запись остаётся в _dirty или _flushing, пока не попадёт в базу
+            del cache[key]
+
+    async def _record(self, chat, user):
+        key = tuple(map(str, self.check_address(chat=chat, user=user)))
+        record = self._unsaved(key)
+        if record is None:
+            row = await self.db.fetchone('SELECT state, data, bucket FROM fsm WHERE chat = ? AND user = ?', key)
+            # Пока ждали базу, запись мог загрузить параллельный апдейт или начать сохранять flush
+            record = self._unsaved(key)
+            if record is None:
+                if row:
+                    record = FSMRecord(row[0], json.loads(row[1] or '{}'), json.loads(row[2] or '{}'))
+                else:
+                    record = FSMRecord()
+        record.touched = time.monotonic()
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        self._evict()
+        return key, record
+
+    def _unsaved(self, key):
+        """Запись из памяти: кэш, несохранённые изменения или сохраняемые прямо сейчас."""
+        record = self._cache.get(key)
+        if record is None:
+            record = self._dirty.get(key)
+        if record is None:
+            record = self._flushing.get(key)
+        return record
+
+    def _changed(self, key, record):
+        self._dirty[key] = record
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            dirty = self._flushing = self._dirty
+            self._dirty = {}
+            upserts = []
+            deletes = []
+            for (chat, user), record in dirty.items():
+                if record.is_empty():
+                    deletes.append((chat, user))
+                else:
+                    upserts.append((chat, user, record.state, json.dumps(record.data, ensure_ascii=False),
+                                    json.dumps(record.bucket, ensure_ascii=False)))
+            try:
+                async with self.db.write() as conn:
+                    await conn.executemany('''
+                        INSERT INTO fsm (chat, user, state, data, bucket) VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT(chat, user) DO UPDATE
+                        SET state = excluded.state, data = excluded.data, bucket = excluded.bucket
+                    ''', upserts)
+                    await conn.executemany('DELETE FROM fsm WHERE chat = ? AND user = ?', deletes)
+            except BaseException:
+                # Не теряем изменения (и при отмене): вернём их, если новых по тем же ключам ещё не было
+                for key, record in dirty.items():
+                    self._dirty.setdefault(key, record)
+                raise
+            finally:
+                self._flushing = {}
+            # Пустые записи уходят из кэша только после коммита и если их не успели снова изменить
+            for key in deletes:
+                record = self._cache.get(key)
+                if record is dirty[key] and record.is_empty() and key not in self._dirty:
+                    del self._cache[key]
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении FSM: {e}")
+
+    async def count(self):
+        row = await self.db.fetchone('SELECT COUNT(*) FROM fsm')
+        return row[0]
+
+    async def import_data(self, data):
+        """
+        Перенос данных в формате MemoryStorage.data:
+        {chat: {user: {'state': ..., 'data': {...}, 'bucket': {...}}}}
+        """
+        imported = 0
+        for chat, users in data.items():
+            for user, value in users.items():
+                record = FSMRecord(value.get('state'), copy.deepcopy(value.get('data') or {}),
+                                   copy.deepcopy(value.get('bucket') or {}))
+                if not record.is_empty():
+                    self._dirty[(str(chat), str(user))] = record
+                    imported += 1
+        await self.flush()
+        return imported
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        _, record = await self._record(chat, user)
+        return record.state if record.state is not None else self.resolve_state(default)
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[dict] = None) -> typing.Dict:
+        _, record = await self._record(chat, user)
+        return copy.deepcopy(record.data)
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None, **kwargs):
+        if data is None:
+            data = {}
+        key, record = await self._record(chat, user)
+        record.data.update(data, **kwargs)
+        self._changed(key, record)
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.AnyStr = None):
+        key, record = await self._record(chat, user)
+        record.state = self.resolve_state(state)
+        self._changed(key, record)
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        key, record = await self._record(chat, user)
+        record.data = copy.deepcopy(data) if data else {}
+        self._changed(key, record)
+
+    async def reset_state(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          with_data: typing.Optional[bool] = True):
+        key, record = await self._record(chat, user)
+        record.state = None
+        if with_data:
+            record.data = {}
+        self._changed(key, record)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        _, record = await self._record(chat, user)
+        return copy.deepcopy(record.bucket)
+
+    async def set_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        key, record = await self._record(chat, user)
+        record.bucket = copy.deepcopy(bucket) if bucket else {}
+        self._changed(key, record)
+
+    async def update_bucket(self, *,
+                            chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None,
+                            bucket: typing.Dict = None, **kwargs):
+        if bucket is None:
+            bucket = {}
+        key, record = await self._record(chat, user)
+        record.bucket.update(bucket, **kwargs)
+        self._changed(key, record)
+
+
+def dump_memory_storage(storage, path):
+    """Снимок MemoryStorage в JSON, чтобы потом загрузить его в SQLiteStorage.import_data."""
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(storage.data, file, ensure_ascii=False)
+
+
+def load_memory_snapshot(path):
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
@@ -0,0 +1,113 @@
+import codecs
+import time
+
+from catalog import INSERT_UNIQUE, text_hash
+
+
+async def download_chunks(bot, file_path, chunk_size=65536):
+    """Файл с серверов Telegram по кускам, без загрузки целиком в память."""
+    session = await bot.get_session()
+    async with session.get(bot.get_file_url(file_path), proxy=bot.proxy, proxy_auth=bot.proxy_auth,
+                           raise_for_status=True) as response:
+        async for chunk in response.content.iter_chunked(chunk_size):
+            yield chunk
+
+
+async def download_to_file(bot, file_path, file, chunk_size=65536):
+    """Скачивает файл в открытый бинарный file по кускам и перематывает его в начало."""
+    async for chunk in download_chunks(bot, file_path, chunk_size):
+        file.write(chunk)
+    file.seek(0)
+
+
+async def file_chunks(file, chunk_size=65536):
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+class QuoteScanner:
+    """
+    Разбор фраз в кавычках "..." по кускам текста. Кавычка может оказаться
+    на границе куска, поэтому незакрытая фраза копится между вызовами.
+    """
+
+    def __init__(self):
+        self._inside = False
+        self._parts = []
+
+    def feed(self, text):
+        phrases = []
+        position = 0
+        while True:
+            quote = text.find('"', position)
+            if quote < 0:
+                if self._inside:
+                    self._parts.append(text[position:])
+                return phrases
+            if self._inside:
+                self._parts.append(text[position:quote])
+                phrases.append(''.join(self._parts))
+                self._parts = []
+            self._inside = not self._inside
+            position = quote + 1
+
+
+async def iter_phrases(chunks, encoding='utf-8'):
+    decoder = codecs.getincrementaldecoder(encoding)()
+    scanner = QuoteScanner()
+    async for chunk in chunks:
+        for phrase in scanner.feed(decoder.decode(chunk)):
+            yield phrase
+    for phrase in scanner.feed(decoder.decode(b'', final=True)):
+        yield phrase
+
+
+class ImportResult:
+    __slots__ = ('found', 'added', 'new_rows')
+
+    def __init__(self):
+        self.found = 0
+        self.added = 0
+        self.new_rows = []
+
+    @property
+    def skipped(self):
+        return self.found - self.added
+
+
+async def import_phrases(db, phrases, batch_size=1000, on_progress=None, progress_interval=2.0):
+    """
+    Вставка фраз пачками executemany в одной транзакции. Дубликаты
+    (и в базе, и внутри файла) отсекаются уникальным индексом по хэшу
+    нормализованного текста, phrases(norm_hash).
+    Транзакция держит запись для всех, поэтому phrases должны читаться
+    из локального файла, а не из сети. on_progress(result) — обычная
+    функция, транзакция её не ждёт; вызывается не чаще раза в
+    progress_interval секунд.
+    """
+    result = ImportResult()
+    last_progress = time.monotonic()
+    async with db.write() as conn:
+        async with conn.execute('SELECT COALESCE(MAX(id), 0) FROM phrases') as cursor:
+            last_id = (await cursor.fetchone())[0]
+        batch = []
+        async for phrase in phrases:
+            if not phrase.strip():
+                continue
+            result.found += 1
+            batch.append((phrase, text_hash(phrase)))
+            if len(batch) >= batch_size:
+                # rowcount, а не total_changes: вставки триггеров FTS не считаются
+                result.added += (await conn.executemany(INSERT_UNIQUE, batch)).rowcount
+                batch = []
+                if on_progress is not None and time.monotonic() - last_progress >= progress_interval:
+                    last_progress = time.monotonic()
+                    on_progress(result)
+        if batch:
+            result.added += (await conn.executemany(INSERT_UNIQUE, batch)).rowcount
+        async with conn.execute('SELECT id, text FROM phrases WHERE id > ? ORDER BY id', (last_id,)) as cursor:
+            result.new_rows = await cursor.fetchall()
+    return result
@@ -0,0 +1,70 @@
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class InlineCharges:
+    """
+    Когда списывать запрос за inline-режим. Основной способ — за каждую
+    выбранную фразу (chosen_inline_result), но эти апдейты приходят, только
+    если в @BotFather включён /setinlinefeedback. Поэтому первая страница
+    с фразами тоже списывает запрос, не чаще раза в window секунд на
+    пользователя. Такое списание служит авансом: первая выбранная после
+    него фраза бесплатна, так что при включённой обратной связи каждая
+    отправка считается один раз.
+    """
+
+    def __init__(self, window=60, maxsize=100000, feedback_threshold=50):
+        self.window = window
+        self.maxsize = maxsize
+        self.feedback_threshold = feedback_threshold
+        self.query_charges = 0
+        self.choices = 0
+        # user_id -> (время списания, не израсходован ли аванс)
+        self._charges = OrderedDict()
+
+    def __len__(self):
+        return len(self._charges)
+
+    def _evict(self, now):
+        deadline = now - self.window
+        charges = self._charges
+        while charges:
+            charged_at, _ = next(iter(charges.values()))
+            if len(charges) <= self.maxsize and charged_at > deadline:
+                break
+            charges.popitem(last=False)
+
+    def _store(self, user_id, now, credit):
+        self._charges[user_id] = (now, credit)
+        self._charges.move_to_end(user_id)
+        self._evict(now)
+
+    def charge_query(self, user_id):
+        """True, если за первую страницу с фразами нужно списать запрос."""
+        now = time.monotonic()
+        self._evict(now)
+        if user_id in self._charges:
+            return False
+        self.query_charges += 1
+        if self.query_charges == self.feedback_threshold and not self.choices:
+            # Списаний по запросам много, а выборов ни одного — обратная связь, похоже, выключена
+            logger.warning(f"Не приходят chosen_inline_result: inline-запросы списываются не чаще раза "
+                           f"в {self.window} с. Чтобы считать каждую отправленную фразу, включите "
+                           f"/setinlinefeedback в @BotFather")
+        self._store(user_id, now, True)
+        return True
+
+    def charge_choice(self, user_id):
+        """True, если за выбранную фразу нужно списать запрос; False — её покрыл аванс."""
+        now = time.monotonic()
+        self.choices += 1
+        self._evict(now)
+        entry = self._charges.get(user_id)
+        if entry is not None and entry[1]:
+            self._charges[user_id] = (entry[0], False)
+            return False
+        self._store(user_id, now, False)
+        return True
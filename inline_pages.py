@@ -0,0 +1,85 @@
+import json
+import random
+import time
+from collections import OrderedDict
+
+from catalog import normalize
+
+# Ограничения Bot API: до 50 результатов в ответе, заголовок показывается в одну строку
+MAX_PAGE_SIZE = 50
+TITLE_LIMIT = 64
+
+
+def article(phrase_id, text):
+    return {
+        'type': 'article',
+        'id': str(phrase_id),
+        'title': text if len(text) <= TITLE_LIMIT else text[:TITLE_LIMIT - 1] + '…',
+        'description': text[TITLE_LIMIT - 1:] if len(text) > TITLE_LIMIT else '',
+        'input_message_content': {'message_text': text},
+    }
+
+
+def serialize(rows):
+    # answer_inline_query передаёт строку results как есть, без повторного json.dumps
+    return json.dumps([article(phrase_id, text) for phrase_id, text in rows], ensure_ascii=False,
+                      separators=(',', ':'))
+
+
+class InlinePages:
+    """
+    Готовые страницы ответов на inline-запросы, уже сериализованные в JSON.
+    Пустой запрос получает одну из random_pages заранее собранных страниц
+    случайных фраз. Поиск выполняется один раз на запрос: все max_results
+    совпадений режутся на страницы и живут в LRU ttl секунд. После изменения
+    фраз страницы сбрасываются вызовом invalidate.
+    """
+
+    def __init__(self, phrase_index, search, page_size=20, random_pages=50, max_results=100, ttl=600,
+                 maxsize=1000, rng=None):
+        self.phrase_index = phrase_index
+        self.search = search
+        self.page_size = min(page_size, MAX_PAGE_SIZE)
+        self.random_pages = random_pages
+        self.max_results = max_results
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._random = rng or random.Random()
+        self._random_pages = []
+        self._search_pages = OrderedDict()
+
+    def __len__(self):
+        return len(self._random_pages) + len(self._search_pages)
+
+    def invalidate(self):
+        self._random_pages = []
+        self._search_pages.clear()
+
+    def random_page(self):
+        """JSON со случайными фразами или None, если фраз нет."""
+        if not self._random_pages:
+            self._random_pages = [serialize(self.phrase_index.sample(self.page_size))
+                                  for _ in range(self.random_pages if len(self.phrase_index) else 0)]
+        if not self._random_pages:
+            return None
+        return self._random.choice(self._random_pages)
+
+    async def search_page(self, query, offset=''):
+        """(JSON страницы, next_offset); JSON равен None, если ничего не найдено."""
+        key = normalize(query)
+        entry = self._search_pages.get(key)
+        if entry is not None and time.monotonic() < entry[1]:
+            self._search_pages.move_to_end(key)
+            pages = entry[0]
+        else:
+            rows, _ = await self.search(query, self.max_results)
+            pages = [serialize(rows[start:start + self.page_size]) for start in range(0, len(rows), self.page_size)]
+            self._search_pages[key] = (pages, time.monotonic() + self.ttl)
+            self._search_pages.move_to_end(key)
+            while len(self._search_pages) > self.maxsize:
+                self._search_pages.popitem(last=False)
+
+        number = int(offset) if offset.isdigit() else 0
+        if number >= len(pages):
+            return None, ''
+        return pages[number], str(number + 1) if number + 1 < len(pages) else ''
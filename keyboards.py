@@ -0,0 +1,53 @@
+import json
+from collections import OrderedDict
+
+from aiogram.types import InlineKeyboardMarkup
+
+
+def serialize(markup):
+    # Bot API принимает reply_markup готовой JSON-строкой, aiogram передаёт её как есть
+    return json.dumps(markup.to_python(), ensure_ascii=False, separators=(',', ':'))
+
+
+class KeyboardRegistry:
+    """
+    Клавиатуры, собранные и сериализованные один раз. Статические хранятся
+    по имени, динамические (например, страницы удаления фраз) — в LRU по ключу
+    до вызова invalidate.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._static = {}
+        self._dynamic = OrderedDict()
+
+    def add(self, name, *rows, row_width=3):
+        """Каждый аргумент — ряд кнопок."""
+        markup = InlineKeyboardMarkup(row_width=row_width)
+        for row in rows:
+            markup.row(*row)
+        self._static[name] = serialize(markup)
+        return self._static[name]
+
+    def __getitem__(self, name):
+        return self._static[name]
+
+    def get_cached(self, namespace, key):
+        value = self._dynamic.get((namespace, key))
+        if value is not None:
+            self._dynamic.move_to_end((namespace, key))
+        return value
+
+    def cache(self, namespace, key, markup):
+        value = serialize(markup)
+        self._dynamic[(namespace, key)] = value
+        while len(self._dynamic) > self.maxsize:
+            self._dynamic.popitem(last=False)
+        return value
+
+    def invalidate(self, namespace=None):
+        if namespace is None:
+            self._dynamic.clear()
+            return
+        for key in [key for key in self._dynamic if key[0] == namespace]:
+            del self._dynamic[key]
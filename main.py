@@ -1,8 +1,10 @@
 from typing import Union
+import asyncio
 import logging
-import aiosqlite
-from datetime import datetime, timedelta
-from aiogram import Bot, Dispatcher, types
+import tempfile
+import time
+from aiogram import Dispatcher, types
+from aiogram.bot.api import TELEGRAM_PRODUCTION, TelegramAPIServer
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher import FSMContext
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
@@ -11,7 +13,26 @@ from aiogram.utils.exceptions import MessageNotModified
 from aiogram.dispatcher.filters.state import State, StatesGroup
 import os
 from dotenv import load_dotenv
-import re
+
+from database import Database
+from catalog import INSERT_UNIQUE, PhraseCatalog, text_hash
+from phrase_index import PhraseIndex
+from inline_pages import InlinePages
+from inline_charges import InlineCharges
+from broadcast import Broadcaster, format_minute, format_offset, parse_times
+from shuffle_bag import ShuffleBag
+from subscription_cache import SubscriptionCache
+from quota import MemoryQuotaStore, create_quota_store
+from importer import download_to_file, file_chunks, import_phrases, iter_phrases
+from webhook import start_webhook
+from outbound import ScheduledBot
+from router import CallbackRouter
+from keyboards import KeyboardRegistry
+from metrics import HandlerMetricsMiddleware, Metrics
+from cluster import Cluster
+from fsm_storage import SQLiteStorage, dump_memory_storage, load_memory_snapshot
+from exporter import (ThrottledSender, iter_numbered_lines, iter_phrase_rows, iter_quoted_lines, pack_messages,
+                      send_document)
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -20,15 +41,150 @@ API_TOKEN = os.getenv('API_TOKEN')
 CHANNEL_USERNAME = os.getenv('CHANNEL_USERNAME', '@My_ProReels')
 ADMIN_ID = int(os.getenv('ADMIN_ID'))
 DB_NAME = os.getenv('DB_NAME', 'phrases.db')
+DB_READERS = int(os.getenv('DB_READERS', 4))
+# random — случайная фраза, shuffle — без повторов до конца цикла
+PHRASE_MODE = os.getenv('PHRASE_MODE', 'random')
+# Сколько помнить циклы shuffle: забытый пользователь начинает цикл заново.
+# Запись занимает около 180 байт, миллион пользователей — около 180 МБ
+SHUFFLE_MAX_USERS = int(os.getenv('SHUFFLE_MAX_USERS', 1000000))
+SHUFFLE_IDLE_TTL = int(os.getenv('SHUFFLE_IDLE_TTL', 7 * 24 * 60 * 60))
+FREE_REQUESTS = int(os.getenv('FREE_REQUESTS', 3))
+SUBSCRIPTION_TTL = int(os.getenv('SUBSCRIPTION_TTL', 300))
+SUBSCRIPTION_NEGATIVE_TTL = int(os.getenv('SUBSCRIPTION_NEGATIVE_TTL', 30))
+SUBSCRIPTION_CACHE_SIZE = int(os.getenv('SUBSCRIPTION_CACHE_SIZE', 100000))
+# memory, sqlite или redis
+QUOTA_BACKEND = os.getenv('QUOTA_BACKEND', 'memory')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 1000))
+# Сколько фраз показывает /search
+SEARCH_LIMIT = int(os.getenv('SEARCH_LIMIT', 10))
+# Inline-режим (@bot запрос): фраз на странице ответа и сколько Telegram кэширует ответ, с.
+# Случайные фразы кэшируются недолго, иначе пользователь долго видит одну и ту же подборку
+INLINE_PAGE_SIZE = int(os.getenv('INLINE_PAGE_SIZE', 20))
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', 300))
+INLINE_RANDOM_CACHE_TIME = int(os.getenv('INLINE_RANDOM_CACHE_TIME', 10))
+INLINE_MAX_RESULTS = int(os.getenv('INLINE_MAX_RESULTS', 100))
+# Без /setinlinefeedback в @BotFather inline-запрос списывается не чаще раза в это число секунд
+INLINE_CHARGE_WINDOW = int(os.getenv('INLINE_CHARGE_WINDOW', 60))
+# Больше этого числа фраз список отправляется только файлом
+EXPORT_MESSAGES_LIMIT = int(os.getenv('EXPORT_MESSAGES_LIMIT', 2000))
+# polling или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = int(os.getenv('WEBAPP_PORT', 8080))
+SHUTDOWN_DRAIN_TIMEOUT = int(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', 30))
+# Лимиты Telegram: ~30 сообщений в секунду всего и ~1 в секунду в один чат
+API_GLOBAL_RATE = float(os.getenv('API_GLOBAL_RATE', 30))
+API_CHAT_RATE = float(os.getenv('API_CHAT_RATE', 1))
+API_CHAT_BURST = int(os.getenv('API_CHAT_BURST', 3))
+# sqlite или memory
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'sqlite')
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', 10000))
+FSM_IDLE_TTL = int(os.getenv('FSM_IDLE_TTL', 3600))
+# Снимок MemoryStorage для переноса состояний в SQLite
+FSM_SNAPSHOT = os.getenv('FSM_SNAPSHOT', 'fsm_snapshot.json')
+# Метрики Prometheus на http://METRICS_HOST:METRICS_PORT/metrics, по умолчанию выключены
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes')
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9100))
+# Больше одного — фронт раскладывает апдейты по процессам-воркерам по chat_id.
+# Чат всегда попадает в один воркер, поэтому лимиты и FSM пользователя живут в одном процессе
+WORKERS = int(os.getenv('WORKERS', 1))
+# Свой сервер Bot API (локальный telegram-bot-api или заглушка для нагрузочных тестов)
+BOT_API_SERVER = os.getenv('BOT_API_SERVER')
+# Ежедневная рассылка: время на выбор по местному времени (UTC + BROADCAST_UTC_OFFSET минут),
+# скорость в сообщениях в секунду. Рассылает один процесс (воркер 0)
+BROADCAST_ENABLED = os.getenv('BROADCAST_ENABLED', '1').lower() in ('1', 'true', 'yes')
+BROADCAST_TIMES = parse_times(os.getenv('BROADCAST_TIMES', '07:00,08:00,09:00,10:00,12:00,21:00'))
+BROADCAST_UTC_OFFSET = int(os.getenv('BROADCAST_UTC_OFFSET', 180))
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 20))
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', 100))
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-bot = Bot(token=API_TOKEN)
-storage = MemoryStorage()
+bot = ScheduledBot(token=API_TOKEN, server=TelegramAPIServer.from_base(BOT_API_SERVER) if BOT_API_SERVER
+                   else TELEGRAM_PRODUCTION, scheduler_options={
+    # Общий лимит бота делится между воркерами
+    'global_rate': API_GLOBAL_RATE / WORKERS,
+    'chat_rate': API_CHAT_RATE,
+    'chat_burst': API_CHAT_BURST,
+})
+db = Database(DB_NAME, readers=DB_READERS)
+catalog = PhraseCatalog(db)
+cluster = Cluster(workers=WORKERS)
+if FSM_STORAGE == 'memory':
+    storage = MemoryStorage()
+else:
+    storage = SQLiteStorage(db, maxsize=FSM_CACHE_SIZE, idle_ttl=FSM_IDLE_TTL)
 dp = Dispatcher(bot, storage=storage)
 
-user_requests = {}
+callback_router = CallbackRouter()
+user_callbacks = callback_router.group()
+admin_callbacks = callback_router.group(lambda c: c.from_user.id == ADMIN_ID)
+callback_router.register(dp)
+
+metrics = Metrics(enabled=METRICS_ENABLED)
+subscription_check_seconds = metrics.histogram('bot_subscription_check_seconds', 'Время проверки подписки')
+metrics.instrument_bot(bot)
+if metrics.enabled:
+    dp.middleware.setup(HandlerMetricsMiddleware(metrics.handler_seconds, callback_router))
+
+keyboards = KeyboardRegistry()
+get_phrase_button = InlineKeyboardButton("Получить фразу", callback_data="get_phrase")
+back_to_admin_button = InlineKeyboardButton("Назад", callback_data="admin_panel")
+main_rows = [[get_phrase_button]]
+if BROADCAST_ENABLED:
+    main_rows.append([InlineKeyboardButton("Фраза каждый день", callback_data="daily")])
+keyboards.add('main', *main_rows)
+keyboards.add('main_admin', *main_rows, [InlineKeyboardButton("Админ панель", callback_data="admin_panel")])
+daily_time_buttons = [InlineKeyboardButton(format_minute(minute), callback_data=f"daily_time:{minute}")
+                      for minute in BROADCAST_TIMES]
+daily_time_rows = [daily_time_buttons[i:i + 3] for i in range(0, len(daily_time_buttons), 3)]
+back_to_main_button = InlineKeyboardButton("Назад", callback_data="back_to_main")
+keyboards.add('daily_menu', *daily_time_rows, [back_to_main_button])
+keyboards.add('daily_menu_subscribed', *daily_time_rows,
+              [InlineKeyboardButton("Отключить", callback_data="daily_off")], [back_to_main_button])
+keyboards.add('subscribe', [InlineKeyboardButton("Я подписался", callback_data="check_subscription")])
+keyboards.add('admin_panel',
+              [InlineKeyboardButton("Добавить фразы", callback_data="add_phrases"),
+               InlineKeyboardButton("Удалить фразы", callback_data="delete_phrases")],
+              [InlineKeyboardButton("Список фраз", callback_data="list_phrases"),
+               InlineKeyboardButton("Загрузить фразы из файла", callback_data="upload_phrases")],
+              [InlineKeyboardButton("Назад", callback_data="back_to_main")])
+keyboards.add('back_to_admin', [back_to_admin_button])
+keyboards.add('confirm_add', [InlineKeyboardButton("Добавить", callback_data="confirm_add"), back_to_admin_button])
+keyboards.add('added', [InlineKeyboardButton("Добавить еще фразу", callback_data="add_more"), back_to_admin_button])
+keyboards.add('delete_menu',
+              [InlineKeyboardButton("Удалить все фразы", callback_data="delete_all_phrases")],
+              [InlineKeyboardButton("Выбрать фразы для удаления", callback_data="select_delete_phrases")],
+              [back_to_admin_button])
+keyboards.add('delete_all_confirm', [InlineKeyboardButton("Да", callback_data="confirm_delete_all"),
+                                     InlineKeyboardButton("Нет", callback_data="delete_phrases")])
+keyboards.add('list_phrases', [InlineKeyboardButton("Скачать .txt", callback_data="export_phrases"),
+                               back_to_admin_button])
+
+
+def main_keyboard(user_id):
+    return keyboards['main_admin'] if user_id == ADMIN_ID else keyboards['main']
+
+
+phrase_index = PhraseIndex()
+shuffle_bag = ShuffleBag(phrase_index, maxsize=SHUFFLE_MAX_USERS, idle_ttl=SHUFFLE_IDLE_TTL)
+inline_pages = InlinePages(phrase_index, lambda query, limit: search_catalog(query, limit),
+                           page_size=INLINE_PAGE_SIZE, max_results=INLINE_MAX_RESULTS, ttl=INLINE_CACHE_TIME)
+inline_charges = InlineCharges(window=INLINE_CHARGE_WINDOW)
+# Без фраз рассылка ждёт: заглушка «Нет доступных фраз» не должна уйти подписчикам как фраза дня
+broadcaster = Broadcaster(db, bot, lambda user_id: get_random_phrase(user_id, default=None),
+                          utc_offset=BROADCAST_UTC_OFFSET, rate=BROADCAST_RATE, batch_size=BROADCAST_BATCH_SIZE,
+                          enabled=BROADCAST_ENABLED)
+
+user_requests = create_quota_store(QUOTA_BACKEND, db=db, redis_url=REDIS_URL)
+user_requests.get = metrics.timed(metrics.db_seconds, 'quota_get')(user_requests.get)
+user_requests.hit = metrics.timed(metrics.db_seconds, 'quota_hit')(user_requests.hit)
 
 
 class AdminStates(StatesGroup):
@@ -39,43 +195,146 @@ class AdminStates(StatesGroup):
 
 
 async def init_db():
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS phrases
-            (id INTEGER PRIMARY KEY, text TEXT)
-        ''')
-        await db.commit()
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS phrases
+        (id INTEGER PRIMARY KEY, text TEXT)
+    ''')
+    await catalog.migrate()
+
+
+def phrases_changed(op, **change):
+    """
+    op: 'add' (phrase_id, text), 'remove' (phrase_id), 'clear' или 'bulk'
+    (first_id, last_id) — само изменение уходит остальным воркерам.
+    """
+    # Страницы удаления и inline-ответы показывают фразы — после любой записи их нужно пересобрать
+    keyboards.invalidate('delete_pager')
+    inline_pages.invalidate()
+    cluster.publish('phrases_changed', op=op, **change)
+
+
+async def apply_phrases_change(op, phrase_id=None, text=None, first_id=None, last_id=None):
+    # Фразы изменил другой воркер: повторяем изменение в своём индексе, не перечитывая таблицу
+    if op == 'add':
+        phrase_index.add(phrase_id, text)
+    elif op == 'remove':
+        phrase_index.remove(phrase_id)
+    elif op == 'clear':
+        phrase_index.clear()
+    elif first_id is not None:
+        await load_phrase_range(first_id, last_id)
+    else:
+        await load_phrase_index()
+    keyboards.invalidate('delete_pager')
+    inline_pages.invalidate()
+
+
+async def load_phrase_index():
+    phrase_index.load(await get_all_phrases())
+    logger.info(f"Загружено {len(phrase_index)} фраз в индекс")
 
 
+async def load_phrase_range(first_id, last_id, batch_size=10000):
+    # Порциями, чтобы большой импорт не занимал цикл событий целиком
+    while first_id <= last_id:
+        rows = await db.fetchall('SELECT id, text FROM phrases WHERE id BETWEEN ? AND ? ORDER BY id LIMIT ?',
+                                 (first_id, last_id, batch_size))
+        if not rows:
+            break
+        for phrase_id, text in rows:
+            phrase_index.add(phrase_id, text)
+        first_id = rows[-1][0] + 1
+
+
+@metrics.timed(metrics.db_seconds)
+async def search_catalog(query, limit=SEARCH_LIMIT):
+    return await catalog.search(query, limit=limit)
+
+
+@metrics.timed(metrics.db_seconds)
 async def add_phrase(phrase):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute('INSERT INTO phrases (text) VALUES (?)', (phrase,))
-        await db.commit()
+    """id новой фразы или None, если такая фраза уже есть."""
+    phrase_id, added = await db.execute(INSERT_UNIQUE, (phrase, text_hash(phrase)))
+    if not added:
+        return None
+    phrase_index.add(phrase_id, phrase)
+    phrases_changed('add', phrase_id=phrase_id, text=phrase)
+    return phrase_id
 
 
+@metrics.timed(metrics.db_seconds)
 async def delete_phrase(phrase_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute('DELETE FROM phrases WHERE id = ?', (phrase_id,))
-        await db.commit()
+    await db.execute('DELETE FROM phrases WHERE id = ?', (phrase_id,))
+    phrase_index.remove(phrase_id)
+    phrases_changed('remove', phrase_id=phrase_id)
 
 
+@metrics.timed(metrics.db_seconds)
+async def delete_all_phrases():
+    await db.execute('DELETE FROM phrases')
+    phrase_index.clear()
+    phrases_changed('clear')
+
+
+@metrics.timed(metrics.db_seconds)
 async def get_all_phrases():
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute('SELECT id, text FROM phrases') as cursor:
-            return await cursor.fetchall()
+    return await db.fetchall('SELECT id, text FROM phrases')
+
 
+@metrics.timed(metrics.db_seconds)
+async def get_phrase_by_id(phrase_id):
+    return await db.fetchone('SELECT id, text FROM phrases WHERE id = ?', (phrase_id,))
 
-async def get_random_phrase():
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute('SELECT text FROM phrases ORDER BY RANDOM() LIMIT 1') as cursor:
-            result = await cursor.fetchone()
-            return result[0] if result else "Нет доступных фраз"
 
+def count_phrases():
+    # Индекс повторяет каждую запись в таблицу, так что COUNT(*) не нужен
+    return len(phrase_index)
 
-async def check_subscription(user_id):
+
+@metrics.timed(metrics.db_seconds)
+async def get_phrases_page(after_id=0, before_id=None, limit=3):
+    """
+    Keyset-пагинация по id: страница после after_id или перед before_id.
+    Возвращает (rows, has_prev, has_next).
+    """
+    if before_id is None:
+        rows = await db.fetchall('SELECT id, text FROM phrases WHERE id > ? ORDER BY id LIMIT ?',
+                                 (after_id, limit + 1))
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+        has_prev = bool(rows) and await db.fetchone('SELECT 1 FROM phrases WHERE id < ? LIMIT 1',
+                                                    (rows[0][0],)) is not None
+    else:
+        rows = await db.fetchall('SELECT id, text FROM phrases WHERE id < ? ORDER BY id DESC LIMIT ?',
+                                 (before_id, limit + 1))
+        has_prev = len(rows) > limit
+        rows = rows[:limit][::-1]
+        has_next = bool(rows) and await db.fetchone('SELECT 1 FROM phrases WHERE id > ? LIMIT 1',
+                                                    (rows[-1][0],)) is not None
+    return rows, has_prev, has_next
+
+
+async def get_random_phrase(user_id=None, default="Нет доступных фраз"):
+    if PHRASE_MODE == 'shuffle' and user_id is not None:
+        phrase = shuffle_bag.next(user_id)
+    else:
+        phrase = phrase_index.random()
+    return phrase if phrase is not None else default
+
+
+async def fetch_subscription(user_id):
+    member = await bot.get_chat_member(CHANNEL_USERNAME, user_id)
+    return member.status in ['creator', 'administrator', 'member']
+
+
+subscription_cache = SubscriptionCache(fetch_subscription, ttl=SUBSCRIPTION_TTL,
+                                       negative_ttl=SUBSCRIPTION_NEGATIVE_TTL, maxsize=SUBSCRIPTION_CACHE_SIZE)
+
+
+@metrics.timed(subscription_check_seconds)
+async def check_subscription(user_id, force=False):
     try:
-        member = await bot.get_chat_member(CHANNEL_USERNAME, user_id)
-        return member.status in ['creator', 'administrator', 'member']
+        return await subscription_cache.get(user_id, force=force)
     except Exception as e:
         logger.error(f"Ошибка при проверке подписки: {e}")
         return False
@@ -83,10 +342,13 @@ async def check_subscription(user_id):
 
 @dp.message_handler(commands=['start'])
 async def send_welcome(message: types.Message, state: FSMContext):
-    keyboard = InlineKeyboardMarkup()
-    keyboard.add(InlineKeyboardButton("Получить фразу", callback_data="get_phrase"))
-    if message.from_user.id == ADMIN_ID:
-        keyboard.add(InlineKeyboardButton("Админ панель", callback_data="admin_panel"))
+    if message.get_args() == 'subscribe':
+        # Пришёл из inline-режима по кнопке об исчерпанном лимите
+        sent_message = await message.answer(f"Вы достигли лимита запросов. Подпишитесь на наш канал {CHANNEL_USERNAME} для неограниченного доступа.",
+                                            reply_markup=keyboards['subscribe'])
+        await state.update_data(last_message_id=sent_message.message_id)
+        return
+    keyboard = main_keyboard(message.from_user.id)
     sent_message = await message.answer("Привет! Я бот, который поможет тебе начать день с вдохновляющей фразы.",
                                         reply_markup=keyboard)
     await state.update_data(last_message_id=sent_message.message_id)
@@ -94,18 +356,10 @@ async def send_welcome(message: types.Message, state: FSMContext):
 
 async def send_phrase(chat_id: int, message_id: int, state: FSMContext):
     user_id = chat_id
-    now = datetime.now()
 
-    if user_id not in user_requests:
-        user_requests[user_id] = {'count': 0, 'reset_time': now + timedelta(days=1)}
-
-    if now >= user_requests[user_id]['reset_time']:
-        user_requests[user_id] = {'count': 0, 'reset_time': now + timedelta(days=1)}
-
-    is_subscribed = await check_subscription(user_id)
-
-    if user_requests[user_id]['count'] >= 3 and not is_subscribed:
-        keyboard = InlineKeyboardMarkup().add(InlineKeyboardButton("Я подписался", callback_data="check_subscription"))
+    # Telegram API спрашиваем только когда бесплатный лимит уже исчерпан
+    if await user_requests.get(user_id) >= FREE_REQUESTS and not await check_subscription(user_id):
+        keyboard = keyboards['subscribe']
         try:
             await bot.edit_message_text(chat_id=chat_id, message_id=message_id,
                                         text=f"Вы достигли лимита запросов. Подпишитесь на наш канал {CHANNEL_USERNAME} для неограниченного доступа.",
@@ -114,12 +368,10 @@ async def send_phrase(chat_id: int, message_id: int, state: FSMContext):
             pass
         return
 
-    phrase = await get_random_phrase()
-    user_requests[user_id]['count'] += 1
+    phrase = await get_random_phrase(user_id)
+    await user_requests.hit(user_id)
 
-    keyboard = InlineKeyboardMarkup().add(InlineKeyboardButton("Получить фразу", callback_data="get_phrase"))
-    if user_id == ADMIN_ID:  # Кнопка админ-панели для админа
-        keyboard.add(InlineKeyboardButton("Админ панель", callback_data="admin_panel"))
+    keyboard = main_keyboard(user_id)  # Кнопка админ-панели для админа
     try:
         await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=phrase, reply_markup=keyboard)
     except MessageNotModified:
@@ -128,7 +380,7 @@ async def send_phrase(chat_id: int, message_id: int, state: FSMContext):
 
 
 
-@dp.callback_query_handler(lambda c: c.data == 'get_phrase')
+@user_callbacks.route('get_phrase')
 async def process_callback_get_phrase(callback_query: types.CallbackQuery, state: FSMContext):
     await bot.answer_callback_query(callback_query.id)
     data = await state.get_data()
@@ -136,24 +388,22 @@ async def process_callback_get_phrase(callback_query: types.CallbackQuery, state
     if last_message_id:
         await send_phrase(callback_query.message.chat.id, last_message_id, state)
     else:
-        keyboard = InlineKeyboardMarkup().add(InlineKeyboardButton("Получить фразу", callback_data="get_phrase"))
-        if callback_query.from_user.id == ADMIN_ID:
-            keyboard.add(InlineKeyboardButton("Админ панель", callback_data="admin_panel"))
+        keyboard = main_keyboard(callback_query.from_user.id)
         sent_message = await bot.send_message(callback_query.message.chat.id, "Нажмите кнопку, чтобы получить фразу.",
                                               reply_markup=keyboard)
         await state.update_data(last_message_id=sent_message.message_id)
 
 
-@dp.callback_query_handler(lambda c: c.data == 'check_subscription')
+@user_callbacks.route('check_subscription')
 async def process_callback_check_subscription(callback_query: types.CallbackQuery, state: FSMContext):
     await bot.answer_callback_query(callback_query.id)
     user_id = callback_query.from_user.id
-    is_subscribed = await check_subscription(user_id)
+    is_subscribed = await check_subscription(user_id, force=True)
 
     if is_subscribed:
         await process_callback_get_phrase(callback_query, state)
     else:
-        keyboard = InlineKeyboardMarkup().add(InlineKeyboardButton("Я подписался", callback_data="check_subscription"))
+        keyboard = keyboards['subscribe']
         try:
             await bot.edit_message_text(chat_id=callback_query.message.chat.id,
                                         message_id=callback_query.message.message_id,
@@ -163,6 +413,78 @@ async def process_callback_check_subscription(callback_query: types.CallbackQuer
             pass
 
 
+@dp.inline_handler()
+async def inline_phrases(inline_query: types.InlineQuery):
+    user_id = inline_query.from_user.id
+    if await user_requests.get(user_id) >= FREE_REQUESTS and not await check_subscription(user_id):
+        # Ответ личный и живёт не дольше отрицательного кэша подписки
+        await bot.answer_inline_query(inline_query.id, results=[], cache_time=SUBSCRIPTION_NEGATIVE_TTL,
+                                      is_personal=True, switch_pm_parameter='subscribe',
+                                      switch_pm_text=f"Лимит исчерпан, подпишитесь на {CHANNEL_USERNAME}")
+        return
+
+    query = inline_query.query.strip()
+    if query:
+        results, next_offset = await inline_pages.search_page(query, inline_query.offset)
+        cache_time = INLINE_CACHE_TIME
+    else:
+        results, next_offset = inline_pages.random_page(), ''
+        cache_time = INLINE_RANDOM_CACHE_TIME
+    # Запросы идут на каждое нажатие клавиши, поэтому списывается запрос за отправленную фразу
+    # (chosen_inline_phrase), а за первую страницу с фразами — не чаще раза в INLINE_CHARGE_WINDOW
+    if results is not None and not inline_query.offset and inline_charges.charge_query(user_id):
+        await user_requests.hit(user_id)
+    # is_personal: общий кэш Telegram раздавал бы ответы и тем, у кого лимит исчерпан
+    await bot.answer_inline_query(inline_query.id, results=results or [], cache_time=cache_time, is_personal=True,
+                                  next_offset=next_offset)
+
+
+# Апдейты о выбранных фразах приходят, только если в @BotFather включён /setinlinefeedback
+@dp.chosen_inline_handler()
+async def chosen_inline_phrase(chosen_result: types.ChosenInlineResult):
+    if inline_charges.charge_choice(chosen_result.from_user.id):
+        await user_requests.hit(chosen_result.from_user.id)
+
+
+async def show_daily_menu(callback_query: types.CallbackQuery, text):
+    minute = await broadcaster.get_minute(callback_query.from_user.id)
+    zone = format_offset(BROADCAST_UTC_OFFSET)
+    if minute is None:
+        text += f"Выберите время, и каждый день я буду присылать вам фразу (время {zone})."
+    else:
+        text += f"Фраза приходит каждый день в {format_minute(minute)} ({zone}). Можно выбрать другое время."
+    try:
+        await bot.edit_message_text(chat_id=callback_query.message.chat.id,
+                                    message_id=callback_query.message.message_id, text=text,
+                                    reply_markup=keyboards['daily_menu' if minute is None else 'daily_menu_subscribed'])
+    except MessageNotModified:
+        pass
+
+
+@user_callbacks.route('daily')
+async def daily_menu(callback_query: types.CallbackQuery):
+    await bot.answer_callback_query(callback_query.id)
+    await show_daily_menu(callback_query, "")
+
+
+@user_callbacks.route('daily_time')
+async def daily_time(callback_query: types.CallbackQuery, args):
+    minute = int(args[0]) if args and args[0].isdigit() else None
+    if minute not in BROADCAST_TIMES:
+        await bot.answer_callback_query(callback_query.id, text="Это время больше недоступно")
+        return
+    await broadcaster.subscribe(callback_query.from_user.id, minute)
+    await bot.answer_callback_query(callback_query.id, text=f"Рассылка в {format_minute(minute)} включена")
+    await show_daily_menu(callback_query, "Готово! ")
+
+
+@user_callbacks.route('daily_off')
+async def daily_off(callback_query: types.CallbackQuery):
+    await broadcaster.unsubscribe(callback_query.from_user.id)
+    await bot.answer_callback_query(callback_query.id, text="Рассылка отключена")
+    await show_daily_menu(callback_query, "Рассылка отключена. ")
+
+
 
 
 async def admin_panel(update: Union[types.Message, types.CallbackQuery], state: FSMContext):
@@ -173,25 +495,47 @@ async def admin_panel(update: Union[types.Message, types.CallbackQuery], state:
         chat_id = update.chat.id
         message_id = update.message_id  # Changed this line
 
-    keyboard = InlineKeyboardMarkup(row_width=2)
-    keyboard.add(
-        InlineKeyboardButton("Добавить фразы", callback_data="add_phrases"),
-        InlineKeyboardButton("Удалить фразы", callback_data="delete_phrases"),
-        InlineKeyboardButton("Список фраз", callback_data="list_phrases"),
-        InlineKeyboardButton("Загрузить фразы из файла", callback_data="upload_phrases"),
-        InlineKeyboardButton("Назад", callback_data="back_to_main")
-    )
+    keyboard = keyboards['admin_panel']
 
     await bot.edit_message_text(
         chat_id=chat_id,
         message_id=message_id,
-        text="Админ панель\nЗдесь вы можете просматривать фразы, которые используются, а также добавлять фразы или удалять их.",
+        text="Админ панель\nЗдесь вы можете просматривать фразы, которые используются, а также добавлять фразы или удалять их.\n"
+             "Поиск фраз: /search <слова>",
         reply_markup=keyboard
     )
     await state.update_data(last_admin_message_id=message_id)
 
 
-@dp.callback_query_handler(lambda c: c.data == 'add_phrases' and c.from_user.id == ADMIN_ID)
+@dp.message_handler(lambda message: message.from_user.id == ADMIN_ID, commands=['search'], state='*')
+async def search_phrases(message: types.Message, state: FSMContext):
+    # Поиск прерывает добавление фразы или загрузку файла, иначе кнопки удаления не сработают
+    if await state.get_state() is not None:
+        await state.finish()
+    query = message.get_args()
+    if not query.strip():
+        await message.answer("Использование: /search <слова>\nПоследнее слово можно не дописывать.")
+        return
+
+    started = time.perf_counter()
+    phrases, has_more = await search_catalog(query)
+    elapsed = (time.perf_counter() - started) * 1000
+    if not phrases:
+        await message.answer(f"Ничего не найдено ({elapsed:.1f} мс)", reply_markup=keyboards['back_to_admin'])
+        return
+
+    lines = [f"{number}. {phrase_text[:200]}" for number, (_, phrase_text) in enumerate(phrases, 1)]
+    if has_more:
+        lines.append("Показаны первые совпадения, уточните запрос.")
+    lines.append(f"Найдено за {elapsed:.1f} мс. Нажмите на фразу, чтобы удалить её.")
+    keyboard = InlineKeyboardMarkup()
+    for phrase_id, phrase_text in phrases:
+        keyboard.add(InlineKeyboardButton(phrase_text[:30] + "...", callback_data=f"delete:{phrase_id}"))
+    keyboard.add(back_to_admin_button)
+    await message.answer("\n".join(lines), reply_markup=keyboard)
+
+
+@admin_callbacks.route('add_phrases')
 async def add_phrases(callback_query: types.CallbackQuery, state: FSMContext):
     await bot.answer_callback_query(callback_query.id)
     if await state.get_state() is not None:
@@ -200,9 +544,7 @@ async def add_phrases(callback_query: types.CallbackQuery, state: FSMContext):
         chat_id=callback_query.message.chat.id,
         message_id=callback_query.message.message_id,
         text="Напишите вашу фразу для добавления",
-        reply_markup=InlineKeyboardMarkup().add(
-            InlineKeyboardButton("Назад", callback_data="admin_panel")
-        )
+        reply_markup=keyboards['back_to_admin']
     )
     await AdminStates.waiting_for_phrase.set()
 
@@ -211,32 +553,27 @@ async def add_phrases(callback_query: types.CallbackQuery, state: FSMContext):
 async def process_new_phrase(message: types.Message, state: FSMContext):
     new_phrase = message.text
     await state.update_data(new_phrase=new_phrase)
-    keyboard = InlineKeyboardMarkup(row_width=2)
-    keyboard.add(
-        InlineKeyboardButton("Добавить", callback_data="confirm_add"),
-        InlineKeyboardButton("Назад", callback_data="admin_panel"),
-    )
+    keyboard = keyboards['confirm_add']
     await message.answer(
         text=f'Ваша новая фраза: "{new_phrase}"',
         reply_markup=keyboard
     )
 
 
-@dp.callback_query_handler(lambda c: c.data == 'confirm_add', state=AdminStates.waiting_for_phrase)
+@admin_callbacks.route('confirm_add', state=AdminStates.waiting_for_phrase)
 async def confirm_add_phrase(callback_query: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
     new_phrase = data.get('new_phrase')
     if new_phrase:
-        await add_phrase(new_phrase)
-        keyboard = InlineKeyboardMarkup(row_width=2)
-        keyboard.add(
-            InlineKeyboardButton("Добавить еще фразу", callback_data="add_more"),
-            InlineKeyboardButton("Назад", callback_data="admin_panel")
-        )
+        if await add_phrase(new_phrase) is None:
+            text = f"Такая фраза уже есть в базе - {new_phrase}"
+        else:
+            text = f"Ваша новая добавленная фраза - {new_phrase}"
+        keyboard = keyboards['added']
         await bot.edit_message_text(
             chat_id=callback_query.message.chat.id,
             message_id=callback_query.message.message_id,
-            text=f"Ваша новая добавленная фраза - {new_phrase}",
+            text=text,
             reply_markup=keyboard
         )
     else:
@@ -244,24 +581,20 @@ async def confirm_add_phrase(callback_query: types.CallbackQuery, state: FSMCont
     await state.finish()
 
 
-@dp.callback_query_handler(lambda c: c.data == 'add_more' and c.from_user.id == ADMIN_ID)
+@admin_callbacks.route('add_more')
 async def add_more_phrases(callback_query: types.CallbackQuery):
     await bot.edit_message_text(
         chat_id=callback_query.message.chat.id,
         message_id=callback_query.message.message_id,
         text="Напишите вашу новую фразу для добавления",
-        reply_markup=InlineKeyboardMarkup().add(InlineKeyboardButton("Назад", callback_data="admin_panel"))
+        reply_markup=keyboards['back_to_admin']
     )
     await AdminStates.waiting_for_phrase.set()
 
 
-@dp.callback_query_handler(lambda c: c.data == 'delete_phrases' and c.from_user.id == ADMIN_ID)
+@admin_callbacks.route('delete_phrases')
 async def delete_phrases(callback_query: types.CallbackQuery):
-    keyboard = InlineKeyboardMarkup(row_width=2)
-    keyboard.add(InlineKeyboardButton("Удалить все фразы", callback_data="delete_all_phrases"))
-    keyboard.add(InlineKeyboardButton("Выбрать фразы для удаления", callback_data="select_delete_phrases"))
-    keyboard.add(InlineKeyboardButton("Назад", callback_data="admin_panel"))
-
+    keyboard = keyboards['delete_menu']
     await bot.edit_message_text(
         chat_id=callback_query.message.chat.id,
         message_id=callback_query.message.message_id,
@@ -270,13 +603,9 @@ async def delete_phrases(callback_query: types.CallbackQuery):
     )
 
 
-@dp.callback_query_handler(lambda c: c.data == 'delete_all_phrases' and c.from_user.id == ADMIN_ID)
+@admin_callbacks.route('delete_all_phrases')
 async def confirm_delete_all_phrases(callback_query: types.CallbackQuery):
-    keyboard = InlineKeyboardMarkup(row_width=2)
-    keyboard.add(
-        InlineKeyboardButton("Да", callback_data="confirm_delete_all"),
-        InlineKeyboardButton("Нет", callback_data="delete_phrases")
-    )
+    keyboard = keyboards['delete_all_confirm']
     await bot.edit_message_text(
         chat_id=callback_query.message.chat.id,
         message_id=callback_query.message.message_id,
@@ -285,63 +614,76 @@ async def confirm_delete_all_phrases(callback_query: types.CallbackQuery):
     )
 
 
-@dp.callback_query_handler(lambda c: c.data == 'confirm_delete_all' and c.from_user.id == ADMIN_ID)
+@admin_callbacks.route('confirm_delete_all')
 async def delete_all_phrases_confirmed(callback_query: types.CallbackQuery):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute('DELETE FROM phrases')
-        await db.commit()
+    await delete_all_phrases()
     await bot.answer_callback_query(callback_query.id, text='Все фразы были удалены!')
     await delete_phrases(callback_query)
 
 
-@dp.callback_query_handler(lambda c: c.data == 'select_delete_phrases' and c.from_user.id == ADMIN_ID)
+@admin_callbacks.route('select_delete_phrases')
 async def select_delete_phrases(callback_query: types.CallbackQuery):
-    await show_phrases_for_deletion(callback_query.message, 0)
+    await show_phrases_for_deletion(callback_query.message)
 
 
-async def show_phrases_for_deletion(message, start_index: int):
-    phrases = await get_all_phrases()
+async def show_phrases_for_deletion(message, after_id: int = 0, before_id: int = None):
+    # Страница зависит только от курсора, пока фразы не менялись — базу не трогаем
+    keyboard = keyboards.get_cached('delete_pager', (after_id, before_id))
+    if keyboard is None:
+        keyboard = keyboards.cache('delete_pager', (after_id, before_id),
+                                   await build_delete_pager(after_id, before_id))
+
+    await bot.edit_message_text(
+        chat_id=message.chat.id,
+        message_id=message.message_id,
+        text=f"Удаление фраз (всего {count_phrases()})\nВыберите фразу из кнопок, которую вы хотите удалить:",
+        reply_markup=keyboard
+    )
+
+
+async def build_delete_pager(after_id, before_id):
+    phrases, has_prev, has_next = await get_phrases_page(after_id, before_id)
+    if not phrases and (after_id or before_id is not None):
+        # Курсор указывает за край таблицы (фразы удалили) — начинаем сначала
+        phrases, has_prev, has_next = await get_phrases_page()
+
     keyboard = InlineKeyboardMarkup(row_width=3)
-    for i in range(start_index, min(start_index + 3, len(phrases))):
-        phrase_id, phrase_text = phrases[i]
+    for phrase_id, phrase_text in phrases:
         keyboard.add(InlineKeyboardButton(phrase_text[:30] + "...", callback_data=f"delete:{phrase_id}"))
 
     nav_buttons = []
-    if start_index > 0:
-        nav_buttons.append(InlineKeyboardButton("⬅️", callback_data=f"nav_delete:{start_index - 3}"))
-    if start_index + 3 < len(phrases):
-        nav_buttons.append(InlineKeyboardButton("➡️", callback_data=f"nav_delete:{start_index + 3}"))
+    if has_prev:
+        nav_buttons.append(InlineKeyboardButton("⬅️", callback_data=f"nav_delete:<{phrases[0][0]}"))
+    if has_next:
+        nav_buttons.append(InlineKeyboardButton("➡️", callback_data=f"nav_delete:>{phrases[-1][0]}"))
     if nav_buttons:
         keyboard.row(*nav_buttons)
 
-    keyboard.add(InlineKeyboardButton("Назад", callback_data="admin_panel"))
-
-    await bot.edit_message_text(
-        chat_id=message.chat.id,
-        message_id=message.message_id,
-        text="Удаление фраз\nВыберите фразу из кнопок, которую вы хотите удалить:",
-        reply_markup=keyboard
-    )
+    keyboard.add(back_to_admin_button)
+    return keyboard
 
 
-@dp.callback_query_handler(lambda c: c.data.startswith('nav_delete:') and c.from_user.id == ADMIN_ID)
-async def navigate_delete_phrases(callback_query: types.CallbackQuery):
-    start_index = int(callback_query.data.split(':')[1])
-    await show_phrases_for_deletion(callback_query.message, start_index)
+@admin_callbacks.route('nav_delete')
+async def navigate_delete_phrases(callback_query: types.CallbackQuery, args):
+    cursor = args[0]
+    if cursor.startswith('<'):
+        await show_phrases_for_deletion(callback_query.message, before_id=int(cursor[1:]))
+    else:
+        await show_phrases_for_deletion(callback_query.message, after_id=int(cursor.lstrip('>')))
 
 
-@dp.callback_query_handler(lambda c: c.data.startswith('delete:') and c.from_user.id == ADMIN_ID)
-async def confirm_delete_phrase(callback_query: types.CallbackQuery):
-    phrase_id = int(callback_query.data.split(':')[1])
-    phrases = await get_all_phrases()
-    phrase_to_delete = next((phrase for phrase in phrases if phrase[0] == phrase_id), None)
+@admin_callbacks.route('delete')
+async def confirm_delete_phrase(callback_query: types.CallbackQuery, args):
+    phrase_id = int(args[0])
+    phrase_to_delete = await get_phrase_by_id(phrase_id)
     if phrase_to_delete:
-        keyboard = InlineKeyboardMarkup(row_width=2)
-        keyboard.add(
-            InlineKeyboardButton("Да", callback_data=f"confirm_delete:{phrase_id}"),
-            InlineKeyboardButton("Нет", callback_data="delete_phrases"),
-            InlineKeyboardButton("Назад", callback_data="admin_panel")
-        )
+        keyboard = keyboards.get_cached('confirm_delete', phrase_id)
+        if keyboard is None:
+            keyboard = keyboards.cache('confirm_delete', phrase_id, InlineKeyboardMarkup(row_width=2).add(
+                InlineKeyboardButton("Да", callback_data=f"confirm_delete:{phrase_id}"),
+                InlineKeyboardButton("Нет", callback_data="delete_phrases"),
+                back_to_admin_button
+            ))
         await bot.edit_message_text(
             chat_id=callback_query.message.chat.id,
             message_id=callback_query.message.message_id,
@@ -352,40 +694,67 @@ async def confirm_delete_phrase(callback_query: types.CallbackQuery):
         await bot.answer_callback_query(callback_query.id, text="Ошибка: фраза не найдена.")
 
 
-@dp.callback_query_handler(lambda c: c.data.startswith('confirm_delete:') and c.from_user.id == ADMIN_ID)
-async def delete_phrase_confirmed(callback_query: types.CallbackQuery):
-    phrase_id = int(callback_query.data.split(':')[1])
+@admin_callbacks.route('confirm_delete')
+async def delete_phrase_confirmed(callback_query: types.CallbackQuery, args):
+    phrase_id = int(args[0])
     await delete_phrase(phrase_id)
     await bot.answer_callback_query(callback_query.id, text=f'Фраза удалена!')
     await delete_phrases(callback_query)
 
 
-@dp.callback_query_handler(lambda c: c.data == 'list_phrases' and c.from_user.id == ADMIN_ID)
+@admin_callbacks.route('list_phrases')
 async def list_phrases(callback_query: types.CallbackQuery):
-    phrases = await get_all_phrases()
-    phrases_list = "\n".join([f"{i + 1}. {phrase[1]}" for i, phrase in enumerate(phrases)])
-    text = f"Список ваших фраз:\n\n{phrases_list}"
+    chat_id = callback_query.message.chat.id
+    keyboard = keyboards['list_phrases']
+    if count_phrases() > EXPORT_MESSAGES_LIMIT:
+        await bot.answer_callback_query(callback_query.id, text="Фраз слишком много, отправляю файлом.")
+        await send_phrases_document(chat_id)
+        return
 
-    if len(text) > 4096:
-        for x in range(0, len(text), 4096):
-            await bot.send_message(callback_query.message.chat.id, text[x:x + 4096])
-    else:
+    messages = pack_messages(iter_numbered_lines(iter_phrase_rows(db)), header="Список ваших фраз:\n")
+    pending = []
+    async for text in messages:
+        pending.append(text)
+        if len(pending) == 2:
+            break
+
+    if len(pending) == 1:
         await bot.edit_message_text(
-            chat_id=callback_query.message.chat.id,
+            chat_id=chat_id,
             message_id=callback_query.message.message_id,
-            text=text,
-            reply_markup=InlineKeyboardMarkup().add(InlineKeyboardButton("Назад", callback_data="admin_panel"))
+            text=pending[0],
+            reply_markup=keyboard
         )
+        return
 
+    # Отстаём на одно сообщение, чтобы клавиатура досталась последнему
+    sender = ThrottledSender(bot, chat_id)
+    await sender.send(pending[0])
+    previous = pending[1]
+    async for text in messages:
+        await sender.send(previous)
+        previous = text
+    await sender.send(previous, reply_markup=keyboard)
 
-@dp.callback_query_handler(lambda c: c.data == 'back_to_main')
-async def back_to_main(callback_query: types.CallbackQuery, state: FSMContext):
+
+@admin_callbacks.route('export_phrases')
+async def export_phrases(callback_query: types.CallbackQuery):
     await bot.answer_callback_query(callback_query.id)
-    keyboard = InlineKeyboardMarkup()
-    keyboard.add(InlineKeyboardButton("Получить фразу", callback_data="get_phrase"))
-    if callback_query.from_user.id == ADMIN_ID:
-        keyboard.add(InlineKeyboardButton("Админ панель", callback_data="admin_panel"))
+    await send_phrases_document(callback_query.message.chat.id)
 
+
+async def send_phrases_document(chat_id):
+    await send_document(
+        bot, chat_id, iter_quoted_lines(iter_phrase_rows(db)),
+        caption=f"Всего фраз: {count_phrases()}",
+        reply_markup=keyboards['back_to_admin']
+    )
+
+
+@user_callbacks.route('back_to_main')
+async def back_to_main(callback_query: types.CallbackQuery, state: FSMContext):
+    await bot.answer_callback_query(callback_query.id)
+    keyboard = main_keyboard(callback_query.from_user.id)
     await bot.edit_message_text(
         chat_id=callback_query.message.chat.id,
         message_id=callback_query.message.message_id,
@@ -395,7 +764,7 @@ async def back_to_main(callback_query: types.CallbackQuery, state: FSMContext):
     await state.update_data(last_message_id=callback_query.message.message_id)
 
 
-@dp.callback_query_handler(lambda c: c.data == 'admin_panel', state='*')
+@admin_callbacks.route('admin_panel', state='*')
 async def admin_panel_handler(callback_query: CallbackQuery, state: FSMContext):
     await bot.answer_callback_query(callback_query.id)
     try:
@@ -407,13 +776,13 @@ async def admin_panel_handler(callback_query: CallbackQuery, state: FSMContext):
     await admin_panel(callback_query, state)
 
 
-@dp.callback_query_handler(lambda c: c.data == 'admin_panel', state=AdminStates.waiting_for_phrase)
+@admin_callbacks.route('admin_panel', state=AdminStates.waiting_for_phrase)
 async def back_to_admin_from_add_phrase(callback_query: types.CallbackQuery, state: FSMContext):
     await state.finish()
     await admin_panel(callback_query, state)
 
 
-@dp.callback_query_handler(lambda c: c.data == 'upload_phrases' and c.from_user.id == ADMIN_ID)
+@admin_callbacks.route('upload_phrases')
 async def upload_phrases(callback_query: types.CallbackQuery, state: FSMContext):
     await bot.answer_callback_query(callback_query.id)
     await AdminStates.waiting_for_file.set()
@@ -423,7 +792,7 @@ async def upload_phrases(callback_query: types.CallbackQuery, state: FSMContext)
         "    \"Люди, побывавшие в «...», что вы думаете\",\n"
         "    \"Один из самых курьёзных случаев в моей практике:\","
     )
-    keyboard = InlineKeyboardMarkup().add(InlineKeyboardButton("Назад", callback_data="admin_panel"))
+    keyboard = keyboards['back_to_admin']
     await bot.edit_message_text(
         chat_id=callback_query.message.chat.id,
         message_id=callback_query.message.message_id,
@@ -440,18 +809,37 @@ async def process_file(message: types.Message, state: FSMContext):
         return
 
     file = await bot.get_file(message.document.file_id)
-    file_path = file.file_path
-    downloaded_file = await bot.download_file(file_path)
-    content = downloaded_file.read().decode('utf-8')
+    progress_message = await message.reply("Импорт фраз начат...")
+    progress = None
 
-    phrases = re.findall(r'"([^"]*)"', content)
-    added_count = 0
-
-    for phrase in phrases:
-        await add_phrase(phrase)
-        added_count += 1
-
-    await message.reply(f"Добавлено {added_count} фраз из файла.")
+    async def edit_progress(text):
+        try:
+            await progress_message.edit_text(text)
+        except MessageNotModified:
+            pass
+        except Exception as e:
+            logger.warning(f"Не удалось обновить прогресс импорта: {e}")
+
+    def report_progress(result):
+        # Импорт держит запись в базу и не ждёт Telegram; пока правка в пути, следующие пропускаются
+        nonlocal progress
+        if progress is None or progress.done():
+            progress = asyncio.ensure_future(
+                edit_progress(f"Импорт фраз: найдено {result.found}, добавлено {result.added}..."))
+
+    # Сначала скачиваем во временный файл: сеть не должна держать транзакцию
+    with tempfile.TemporaryFile() as local_file:
+        await download_to_file(bot, file.file_path, local_file)
+        result = await import_phrases(db, iter_phrases(file_chunks(local_file)), batch_size=IMPORT_BATCH_SIZE,
+                                      on_progress=report_progress)
+    if progress is not None:
+        await progress
+    for phrase_id, phrase in result.new_rows:
+        phrase_index.add(phrase_id, phrase)
+    if result.new_rows:
+        phrases_changed('bulk', first_id=result.new_rows[0][0], last_id=result.new_rows[-1][0])
+
+    await progress_message.edit_text(f"Добавлено {result.added} фраз из файла. Пропущено дубликатов: {result.skipped}.")
     await state.finish()
     await admin_panel(message, state)
 
@@ -469,6 +857,8 @@ async def errors_handler(update, exception):
                                           MessageTextIsEmpty, RetryAfter,
                                           CantParseEntities, MessageCantBeDeleted)
 
+    metrics.count_error(exception)
+
     if isinstance(exception, CantDemoteChatCreator):
         logger.debug("Can't demote chat creator")
         return True
@@ -490,6 +880,10 @@ async def errors_handler(update, exception):
 
     if isinstance(exception, Unauthorized):
         logger.info(f'Unauthorized: {exception}')
+        # Пользователь заблокировал бота — рассылать ему больше некуда
+        user = types.User.get_current()
+        if user is not None and await broadcaster.unsubscribe(user.id):
+            logger.info(f"Пользователь {user.id} удалён из рассылки")
         return True
 
     if isinstance(exception, InvalidQueryID):
@@ -509,10 +903,84 @@ async def errors_handler(update, exception):
     logger.exception(f'Update: {update} \n{exception}')
 
 
+metrics.gauge('bot_phrases', 'Фраз в индексе', count_phrases)
+metrics.gauge('bot_inline_pages', 'Запросов и подборок в кэше inline-ответов', lambda: len(inline_pages))
+metrics.gauge('bot_broadcast_subscribers', 'Подписчиков ежедневной рассылки', broadcaster.count)
+metrics.gauge('bot_subscription_cache_size', 'Записей в кэше подписок', lambda: len(subscription_cache))
+metrics.gauge('bot_shuffle_users', 'Пользователей с запомненным циклом фраз', lambda: len(shuffle_bag))
+metrics.gauge('bot_shuffle_evicted', 'Циклов фраз, забытых из-за SHUFFLE_MAX_USERS', lambda: shuffle_bag.evicted)
+metrics.gauge('bot_outbound_queue_depth', 'Запросов к Bot API в очереди',
+              lambda: bot.scheduler.stats()['queue_depth'])
+if isinstance(user_requests, MemoryQuotaStore):
+    metrics.gauge('bot_quota_users', 'Пользователей с активным лимитом запросов', lambda: len(user_requests))
+if isinstance(storage, SQLiteStorage):
+    metrics.gauge('bot_fsm_records', 'Записей FSM в базе', storage.count)
+    metrics.gauge('bot_fsm_cached_records', 'Записей FSM в кэше', lambda: storage.cache_size)
+else:
+    metrics.gauge('bot_fsm_records', 'Записей FSM в памяти',
+                  lambda: sum(len(users) for users in storage.data.values()))
+
+
+async def import_fsm_snapshot():
+    # В кластере снимок переносит только первый воркер
+    if cluster.worker_index:
+        return
+    if not FSM_SNAPSHOT or not os.path.exists(FSM_SNAPSHOT):
+        return
+    imported = await storage.import_data(load_memory_snapshot(FSM_SNAPSHOT))
+    os.replace(FSM_SNAPSHOT, FSM_SNAPSHOT + '.imported')
+    logger.info(f"Перенесено {imported} состояний FSM из {FSM_SNAPSHOT}")
+
+
 async def on_startup(dp):
+    bot.scheduler.start()
+    await db.connect()
     await init_db()
+    await broadcaster.init()
+    await load_phrase_index()
+    await user_requests.start()
+    if isinstance(storage, SQLiteStorage):
+        await storage.start()
+        await import_fsm_snapshot()
+    if not cluster.worker_index:
+        broadcaster.start()
+    # У каждого воркера свой порт метрик: METRICS_PORT + номер воркера
+    await metrics.start_server(METRICS_HOST, METRICS_PORT + (cluster.worker_index or 0))
+
+
+async def on_shutdown(dp):
+    await metrics.stop_server()
+    await broadcaster.stop()
+    await bot.scheduler.stop()
+    await user_requests.close()
+    if isinstance(storage, SQLiteStorage):
+        await storage.close()
+    elif FSM_SNAPSHOT and not cluster.enabled:
+        dump_memory_storage(storage, FSM_SNAPSHOT)
+    await db.close()
+
+
+cluster.subscribe('phrases_changed', apply_phrases_change)
+
+
+def run_worker(index, sock):
+    cluster.serve_worker(index, sock, dp, on_startup=on_startup, on_shutdown=on_shutdown,
+                         drain_timeout=SHUTDOWN_DRAIN_TIMEOUT)
 
 
 if __name__ == '__main__':
-    executor.start_polling(dp, skip_updates=True, on_startup=on_startup)
+    if cluster.enabled:
+        if FSM_STORAGE == 'memory':
+            logger.warning("FSM_STORAGE=memory с несколькими воркерами: состояния не переживут перезапуск")
+        if BOT_MODE == 'webhook':
+            cluster.run_webhook(bot, run_worker, WEBHOOK_PATH, WEBAPP_HOST, WEBAPP_PORT, webhook_url=WEBHOOK_URL,
+                                secret=WEBHOOK_SECRET, drain_timeout=SHUTDOWN_DRAIN_TIMEOUT)
+        else:
+            cluster.run_polling(bot, run_worker, drain_timeout=SHUTDOWN_DRAIN_TIMEOUT)
+    elif BOT_MODE == 'webhook':
+        start_webhook(dp, WEBHOOK_PATH, WEBAPP_HOST, WEBAPP_PORT, webhook_url=WEBHOOK_URL, secret=WEBHOOK_SECRET,
+                      on_startup=on_startup, on_shutdown=on_shutdown, drain_timeout=SHUTDOWN_DRAIN_TIMEOUT,
+                      health_stats=lambda: {'outbound': bot.scheduler.stats()})
+    else:
+        executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)
 
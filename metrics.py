@@ -0,0 +1,247 @@
+import bisect
+import functools
+import inspect
+import logging
+import time
+
+from aiohttp import web
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.utils.exceptions import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield f'{self.name}{_labels(self.labels, labels)} {value}'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # По меткам: счётчики по корзинам (последняя — +Inf), сумма, количество
+        self._values = {}
+
+    def observe(self, value, *labels):
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def samples(self):
+        for labels, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket
+                le = f'le="{bound}"'
+                yield f'{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labels, labels)} {total}'
+            yield f'{self.name}_count{_labels(self.labels, labels)} {count}'
+
+
+class Gauge:
+    """Значение снимается при каждом запросе /metrics; callback может быть корутиной."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, callback):
+        self.name = name
+        self.help = help
+        self.callback = callback
+
+
+class Metrics:
+    """
+    Метрики бота в формате Prometheus. Выключенные метрики ничего не
+    оборачивают и не ставят middleware, так что обработчики работают как раньше.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._metrics = []
+        self._runner = None
+        self.handler_seconds = self.histogram('bot_handler_seconds', 'Время обработки апдейта', ('handler',))
+        self.db_seconds = self.histogram('bot_db_seconds', 'Время запросов к базе', ('query',))
+        self.api_seconds = self.histogram('bot_api_request_seconds', 'Время запросов к Bot API', ('method',))
+        self.api_errors = self.counter('bot_api_errors_total', 'Ошибки запросов к Bot API', ('method', 'error'))
+        self.retry_after = self.counter('bot_retry_after_total', 'Ответы RetryAfter от Bot API', ('method',))
+        self.handler_errors = self.counter('bot_errors_total', 'Исключения, дошедшие до errors_handler',
+                                           ('error',))
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, callback):
+        if self.enabled:
+            self._metrics.append(Gauge(name, help, callback))
+
+    def timed(self, histogram, label=None):
+        """Декоратор для корутин: время вызова в histogram с меткой label (по умолчанию имя функции)."""
+        def decorator(func):
+            if not self.enabled:
+                return func
+            name = label or func.__name__
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started, name)
+            return wrapper
+        return decorator
+
+    def instrument_bot(self, bot):
+        """Оборачивает отправку запросов ScheduledBot: через scheduler.send идут все методы."""
+        if not self.enabled:
+            return
+        send = bot.scheduler.send
+
+        async def timed_send(method, data=None, files=None, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await send(method, data, files, **kwargs)
+            except RetryAfter:
+                self.retry_after.inc(method)
+                self.api_errors.inc(method, 'RetryAfter')
+                raise
+            except Exception as e:
+                self.api_errors.inc(method, type(e).__name__)
+                raise
+            finally:
+                self.api_seconds.observe(time.perf_counter() - started, method)
+
+        bot.scheduler.send = timed_send
+
+    def count_error(self, exception):
+        if self.enabled:
+            self.handler_errors.inc(type(exception).__name__)
+
+    async def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            if isinstance(metric, Gauge):
+                try:
+                    value = metric.callback()
+                    if inspect.isawaitable(value):
+                        value = await value
+                except Exception as e:
+                    logger.error(f"Не удалось получить значение {metric.name}: {e}")
+                    continue
+                lines.append(f'{metric.name} {value}')
+            else:
+                lines.extend(metric.samples())
+        lines.append('')
+        return '\n'.join(lines)
+
+    async def start_server(self, host, port):
+        if not self.enabled or self._runner is not None:
+            return
+
+        async def handle(request):
+            return web.Response(text=await self.render(), content_type='text/plain', charset='utf-8',
+                                headers={'X-Content-Type-Options': 'nosniff'})
+
+        app = web.Application()
+        app.router.add_get('/metrics', handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+
+    async def stop_server(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Время обработки сообщений, callback- и inline-запросов и выбранных inline-результатов
+    по обработчикам. Callback подписываются префиксом маршрута из CallbackRouter,
+    неизвестные — 'unknown'.
+    """
+
+    def __init__(self, histogram, callback_router=None):
+        super().__init__()
+        self.histogram = histogram
+        self.callback_router = callback_router
+
+    async def on_pre_process_message(self, message, data):
+        data['metrics_started'] = time.perf_counter()
+
+    async def on_process_message(self, message, data):
+        data['metrics_handler'] = current_handler.get().__name__
+
+    async def on_post_process_message(self, message, results, data):
+        self._observe(data, data.get('metrics_handler', 'unhandled'))
+
+    async def on_pre_process_callback_query(self, callback_query, data):
+        data['metrics_started'] = time.perf_counter()
+
+    async def on_post_process_callback_query(self, callback_query, results, data):
+        if self.callback_router is not None:
+            prefix = self.callback_router.parse(callback_query.data or '')[0]
+            name = prefix if prefix in self.callback_router else 'unknown'
+        else:
+            name = 'callback_query'
+        self._observe(data, name)
+
+    async def on_pre_process_inline_query(self, inline_query, data):
+        data['metrics_started'] = time.perf_counter()
+
+    async def on_post_process_inline_query(self, inline_query, results, data):
+        self._observe(data, 'inline_query')
+
+    async def on_pre_process_chosen_inline_result(self, chosen_inline_result, data):
+        data['metrics_started'] = time.perf_counter()
+
+    async def on_post_process_chosen_inline_result(self, chosen_inline_result, results, data):
+        self._observe(data, 'chosen_inline_result')
+
+    def _observe(self, data, name):
+        started = data.pop('metrics_started', None)
+        if started is not None:
+            self.histogram.observe(time.perf_counter() - started, name)
@@ -0,0 +1,298 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from aiogram import Bot
+from aiogram.utils.exceptions import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Методы, на которые распространяются лимиты Telegram на отправку
+CHAT_METHODS = frozenset({
+    'sendMessage', 'sendDocument', 'sendPhoto', 'sendAnimation', 'sendVideo', 'sendAudio', 'sendVoice',
+    'sendSticker', 'copyMessage', 'forwardMessage', 'editMessageText', 'editMessageReplyMarkup',
+    'editMessageCaption', 'deleteMessage',
+})
+PRIORITIES = {
+    'answerCallbackQuery': 0,
+    'answerInlineQuery': 0,
+}
+DEFAULT_PRIORITY = 1
+# Фоновые отправки (рассылка) пропускают вперёд ответы пользователям
+BACKGROUND_PRIORITY = 2
+COALESCE_METHODS = frozenset({'editMessageText', 'editMessageReplyMarkup'})
+
+_priority = contextvars.ContextVar('outbound_priority', default=None)
+
+
+@contextmanager
+def priority(value):
+    """Приоритет всех запросов, отправленных внутри блока (и из запущенных в нём задач)."""
+    token = _priority.set(value)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now):
+        """Сколько секунд ждать до свободного токена."""
+        if now < self.updated:
+            return self.updated - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, now, seconds):
+        # Ответ RetryAfter: следующий токен появится только в now + seconds
+        self.tokens = 1
+        self.updated = max(self.updated, now + seconds)
+
+
+class Job:
+    __slots__ = ('priority', 'seq', 'method', 'data', 'files', 'kwargs', 'chat_id', 'key', 'futures',
+                 'enqueued_at', 'attempts')
+
+    def __init__(self, priority, seq, method, data, files, kwargs, chat_id, key):
+        self.priority = priority
+        self.seq = seq
+        self.method = method
+        self.data = data
+        self.files = files
+        self.kwargs = kwargs
+        self.chat_id = chat_id
+        self.key = key
+        self.futures = [asyncio.get_event_loop().create_future()]
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundScheduler:
+    """
+    Общая очередь исходящих запросов к Bot API: глобальный token bucket и по
+    бакету на чат, ответы на callback вперёд остальных, повтор после RetryAfter
+    и склейка повторных правок одного сообщения, пока они ещё в очереди.
+    """
+
+    def __init__(self, send, global_rate=30, chat_rate=1, chat_burst=3, concurrency=32, max_retries=3,
+                 chat_buckets=10000):
+        self.send = send
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.chat_buckets = chat_buckets
+        self._buckets = {}
+        self._ready = []
+        self._delayed = []
+        self._pending = {}
+        self._seq = itertools.count()
+        self._semaphore = None
+        self._wakeup = None
+        self._task = None
+        self._inflight = 0
+        self._concurrency = concurrency
+        self.sent = 0
+        self.retries = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=1000)
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def start(self):
+        if self._task is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self, timeout=10):
+        """Дожидается опустошения очереди и останавливает цикл."""
+        deadline = time.monotonic() + timeout
+        while (self._ready or self._delayed or self._inflight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= self.chat_buckets:
+                # Бакеты давно молчавших чатов полны, их можно выбросить
+                now = time.monotonic()
+                for stale in [key for key, value in self._buckets.items() if value.delay(now) == 0
+                              and value.tokens >= value.capacity]:
+                    del self._buckets[stale]
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def submit(self, method, data=None, files=None, **kwargs):
+        chat_id = data.get('chat_id') if data and method in CHAT_METHODS else None
+        key = None
+        if method in COALESCE_METHODS and data and not files and 'message_id' in data:
+            key = (method, chat_id, data['message_id'])
+            queued = self._pending.get(key)
+            if queued is not None:
+                # Ещё не отправленная правка того же сообщения просто получает новый текст
+                queued.data = data
+                future = asyncio.get_event_loop().create_future()
+                queued.futures.append(future)
+                self.coalesced += 1
+                return await future
+        job_priority = _priority.get()
+        if job_priority is None:
+            job_priority = PRIORITIES.get(method, DEFAULT_PRIORITY)
+        job = Job(job_priority, next(self._seq), method, data, files, kwargs, chat_id, key)
+        if key is not None:
+            self._pending[key] = job
+        heapq.heappush(self._ready, job)
+        self._wakeup.set()
+        return await job.futures[0]
+
+    def _promote(self, now):
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, job = heapq.heappop(self._delayed)
+            heapq.heappush(self._ready, job)
+
+    def _postpone(self, job, ready_at):
+        heapq.heappush(self._delayed, (ready_at, job.seq, job))
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            self._promote(now)
+            if not self._ready:
+                self._wakeup.clear()
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            delay = self.global_bucket.delay(now)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            job = heapq.heappop(self._ready)
+            if job.chat_id is not None:
+                bucket = self._bucket(job.chat_id)
+                delay = bucket.delay(now)
+                if delay > 0:
+                    self._postpone(job, now + delay)
+                    continue
+                bucket.consume(now)
+            self.global_bucket.consume(now)
+
+            if job.key is not None and self._pending.get(job.key) is job:
+                del self._pending[job.key]
+            await self._semaphore.acquire()
+            self._inflight += 1
+            asyncio.ensure_future(self._execute(job))
+
+    async def _execute(self, job):
+        try:
+            job.attempts += 1
+            result = await self.send(job.method, job.data, job.files, **job.kwargs)
+        except RetryAfter as e:
+            if job.files or job.attempts > self.max_retries:
+                self._finish(job, exception=e)
+            else:
+                self.retries += 1
+                now = time.monotonic()
+                logger.warning(f"RetryAfter {e.timeout} с для {job.method}, повтор {job.attempts}")
+                if job.chat_id is not None:
+                    self._bucket(job.chat_id).pause(now, e.timeout)
+                else:
+                    self.global_bucket.pause(now, e.timeout)
+                self._postpone(job, now + e.timeout)
+                self._wakeup.set()
+        except Exception as e:
+            self._finish(job, exception=e)
+        else:
+            self._finish(job, result=result)
+        finally:
+            self._inflight -= 1
+            self._semaphore.release()
+
+    def _finish(self, job, result=None, exception=None):
+        if exception is not None:
+            self.failed += 1
+        else:
+            self.sent += 1
+        self.latencies.append(time.monotonic() - job.enqueued_at)
+        for future in job.futures:
+            if future.done():
+                continue
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 4)
+
+        return {
+            'queue_depth': len(self._ready) + len(self._delayed),
+            'delayed': len(self._delayed),
+            'inflight': self._inflight,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retries': self.retries,
+            'coalesced': self.coalesced,
+            'latency_p50': percentile(0.5),
+            'latency_p99': percentile(0.99),
+        }
+
+
+class ScheduledBot(Bot):
+    """Bot, который пропускает отправку сообщений через OutboundScheduler."""
+
+    def __init__(self, *args, scheduler_options=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scheduler = OutboundScheduler(super().request, **(scheduler_options or {}))
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        if not self.scheduler.running or (method not in CHAT_METHODS and method not in PRIORITIES):
+            # Через scheduler.send, чтобы у всех запросов была одна точка для обёрток (метрики)
+            return await self.scheduler.send(method, data, files, **kwargs)
+        return await self.scheduler.submit(method, data, files, **kwargs)
@@ -0,0 +1,72 @@
+import random
+from array import array
+
+
+class PhraseIndex:
+    """
+    Копия таблицы phrases в памяти для выбора случайной фразы за O(1).
+    Источником истины остаётся SQLite, индекс лишь повторяет её изменения.
+    """
+
+    __slots__ = ('ids', 'texts', 'max_id', '_positions', '_random')
+
+    def __init__(self, rng=None):
+        self.ids = array('q')
+        self.texts = []
+        self.max_id = 0
+        self._positions = {}
+        self._random = rng or random.Random()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, phrase_id):
+        return phrase_id in self._positions
+
+    def load(self, rows):
+        self.clear()
+        for phrase_id, text in rows:
+            self.add(phrase_id, text)
+
+    def clear(self):
+        self.ids = array('q')
+        self.texts = []
+        self.max_id = 0
+        self._positions = {}
+
+    def add(self, phrase_id, text):
+        if phrase_id in self._positions:
+            self.texts[self._positions[phrase_id]] = text
+            return
+        self._positions[phrase_id] = len(self.ids)
+        self.ids.append(phrase_id)
+        self.texts.append(text)
+        if phrase_id > self.max_id:
+            self.max_id = phrase_id
+
+    def remove(self, phrase_id):
+        # Удаление перестановкой с последним элементом, чтобы массивы оставались плотными
+        position = self._positions.pop(phrase_id, None)
+        if position is None:
+            return False
+        last_id = self.ids.pop()
+        last_text = self.texts.pop()
+        if position < len(self.ids):
+            self.ids[position] = last_id
+            self.texts[position] = last_text
+            self._positions[last_id] = position
+        return True
+
+    def get(self, phrase_id):
+        position = self._positions.get(phrase_id)
+        return None if position is None else self.texts[position]
+
+    def random(self):
+        if not self.ids:
+            return None
+        return self.texts[self._random.randrange(len(self.ids))]
+
+    def sample(self, k):
+        """До k разных случайных фраз парами (id, текст)."""
+        positions = self._random.sample(range(len(self.ids)), min(k, len(self.ids)))
+        return [(self.ids[position], self.texts[position]) for position in positions]
@@ -0,0 +1,329 @@
+import asyncio
+import heapq
+import logging
+import time
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 60 * 60
+
+
+class QuotaRecord:
+    __slots__ = ('count', 'reset_at')
+
+    def __init__(self, count, reset_at):
+        self.count = count
+        self.reset_at = reset_at
+
+
+class MemoryQuotaStore:
+    """
+    Счётчики запросов в памяти. Окно пользователя начинается с первого запроса
+    и длится period секунд; устаревшие записи вычищаются по куче сроков истечения.
+    """
+
+    def __init__(self, period=DAY):
+        self.period = period
+        self._records = {}
+        self._expiry = []
+
+    def __len__(self):
+        return len(self._records)
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def _sweep(self, now):
+        expiry = self._expiry
+        while expiry and expiry[0][0] <= now:
+            reset_at, user_id = heapq.heappop(expiry)
+            record = self._records.get(user_id)
+            if record is not None and record.reset_at == reset_at:
+                del self._records[user_id]
+                self._on_evict(user_id, record)
+
+    def _on_evict(self, user_id, record):
+        pass
+
+    async def _load(self, user_id):
+        return None
+
+    async def _record(self, user_id, now):
+        record = self._records.get(user_id)
+        if record is None:
+            record = await self._load(user_id)
+            if user_id in self._records:
+                # Пока ждали базу, запись уже создал параллельный запрос
+                return self._records[user_id]
+            if record is not None and record.reset_at > now:
+                self._records[user_id] = record
+                heapq.heappush(self._expiry, (record.reset_at, user_id))
+            else:
+                record = None
+        return record
+
+    async def get(self, user_id):
+        now = time.time()
+        self._sweep(now)
+        record = await self._record(user_id, now)
+        return record.count if record is not None else 0
+
+    async def hit(self, user_id):
+        now = time.time()
+        self._sweep(now)
+        record = await self._record(user_id, now)
+        if record is None:
+            record = QuotaRecord(0, now + self.period)
+            self._records[user_id] = record
+            heapq.heappush(self._expiry, (record.reset_at, user_id))
+        record.count += 1
+        self._on_change(user_id, record)
+        return record.count
+
+    def _on_change(self, user_id, record):
+        pass
+
+    async def reset(self, user_id):
+        record = self._records.pop(user_id, None)
+        if record is not None:
+            self._on_evict(user_id, record)
+
+
+class SqliteQuotaStore(MemoryQuotaStore):
+    """
+    Счётчики переживают перезапуск: изменения копятся в памяти
+    и пишутся в SQLite пачкой раз в flush_interval секунд.
+    """
+
+    def __init__(self, db, period=DAY, flush_interval=5, batch_size=1000):
+        super().__init__(period)
+        self.db = db
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._dirty = {}
+        self._deleted = set()
+        # Удаления, которые сейчас записывает flush: до коммита строки ещё в базе
+        self._flushing_deleted = set()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+
+    async def start(self):
+        await self.db.execute('''
+            CREATE TABLE IF NOT EXISTS quotas
+            (user_id INTEGER PRIMARY KEY, count INTEGER NOT NULL, reset_at REAL NOT NULL)
+        ''')
+        await self.db.execute('DELETE FROM quotas WHERE reset_at <= ?', (time.time(),))
+        self._task = asyncio.ensure_future(self._flush_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _load(self, user_id):
+        if user_id in self._deleted or user_id in self._flushing_deleted:
+            return None
+        row = await self.db.fetchone('SELECT count, reset_at FROM quotas WHERE user_id = ?', (user_id,))
+        return QuotaRecord(*row) if row else None
+
+    def _on_change(self, user_id, record):
+        self._deleted.discard(user_id)
+        self._dirty[user_id] = record
+        if len(self._dirty) >= self.batch_size:
+            asyncio.ensure_future(self.flush())
+
+    def _on_evict(self, user_id, record):
+        self._dirty.pop(user_id, None)
+        self._deleted.add(user_id)
+
+    async def flush(self):
+        # Второй flush (от _on_change) ждёт первый, а не пишет параллельно
+        async with self._flush_lock:
+            if not self._dirty and not self._deleted:
+                return
+            dirty, self._dirty = self._dirty, {}
+            deleted, self._deleted = self._deleted, set()
+            self._flushing_deleted = deleted
+            rows = [(user_id, record.count, record.reset_at) for user_id, record in dirty.items()]
+            try:
+                async with self.db.write() as conn:
+                    await conn.executemany('''
+                        INSERT INTO quotas (user_id, count, reset_at) VALUES (?, ?, ?)
+                        ON CONFLICT(user_id) DO UPDATE SET count = excluded.count, reset_at = excluded.reset_at
+                    ''', rows)
+                    await conn.executemany('DELETE FROM quotas WHERE user_id = ?',
+                                           [(user_id,) for user_id in deleted])
+                    await conn.execute('DELETE FROM quotas WHERE reset_at <= ?', (time.time(),))
+            except BaseException:
+                # Не теряем пачку: вернём её, если по тем же пользователям не было новых изменений
+                for user_id, record in dirty.items():
+                    if user_id not in self._deleted:
+                        self._dirty.setdefault(user_id, record)
+                for user_id in deleted:
+                    if user_id not in self._dirty:
+                        self._deleted.add(user_id)
+                raise
+            finally:
+                self._flushing_deleted = set()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении лимитов: {e}")
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisQuotaStore:
+    """
+    Счётчики в Redis для нескольких процессов. Клиент говорит на RESP напрямую,
+    поэтому подходит любой совместимый сервер с EXPIRE ... NX (Redis 7+).
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', period=DAY, prefix='quota:'):
+        self.url = url
+        self.period = period
+        self.prefix = prefix
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    async def start(self):
+        async with self._lock:
+            await self._connect()
+
+    async def close(self):
+        if self._writer is not None:
+            writer = self._writer
+            self._drop()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def _connect(self):
+        parsed = urlparse(self.url)
+        self._reader, self._writer = await asyncio.open_connection(parsed.hostname or 'localhost',
+                                                                   parsed.port or 6379)
+        commands = []
+        if parsed.password:
+            commands.append(('AUTH', parsed.password))
+        database = parsed.path.lstrip('/')
+        if database:
+            commands.append(('SELECT', database))
+        try:
+            for reply in await self._exchange(commands):
+                if isinstance(reply, RedisError):
+                    raise reply
+        except BaseException:
+            self._drop()
+            raise
+
+    def _drop(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    @staticmethod
+    def _encode(*args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            value = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(value), value))
+        return b''.join(parts)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError('Redis закрыл соединение')
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            return RedisError(payload.decode())
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            size = int(payload)
+            if size < 0:
+                return None
+            data = await self._reader.readexactly(size + 2)
+            return data[:-2]
+        if kind == b'*':
+            size = int(payload)
+            if size < 0:
+                return None
+            return [await self._read_reply() for _ in range(size)]
+        raise RedisError(f'Неизвестный ответ Redis: {line!r}')
+
+    async def _exchange(self, commands):
+        self._writer.write(b''.join(self._encode(*command) for command in commands))
+        await self._writer.drain()
+        # Дочитываем все ответы, даже если среди них ошибка, чтобы не сбить поток
+        return [await self._read_reply() for _ in commands]
+
+    async def pipeline(self, *commands):
+        async with self._lock:
+            # Соединение открывается заново после рестарта Redis или обрыва сети
+            if self._writer is None:
+                await self._connect()
+            try:
+                replies = await self._exchange(commands)
+            except BaseException:
+                # Обрыв или отмена посреди обмена: непрочитанные ответы достались бы следующей команде
+                self._drop()
+                raise
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+            # Ошибки команд внутри MULTI приходят элементами ответа EXEC
+            if isinstance(reply, list):
+                for item in reply:
+                    if isinstance(item, RedisError):
+                        raise item
+        return replies
+
+    async def command(self, *args):
+        return (await self.pipeline(args))[0]
+
+    def _key(self, user_id):
+        return f'{self.prefix}{user_id}'
+
+    async def get(self, user_id):
+        value = await self.command('GET', self._key(user_id))
+        return int(value) if value is not None else 0
+
+    async def hit(self, user_id):
+        key = self._key(user_id)
+        # INCR и EXPIRE NX в одной транзакции: ключ не может истечь между ними и остаться без срока.
+        # NX задаёт срок окна только при первом запросе, дальше INCR его сохраняет
+        *_, (count, _) = await self.pipeline(('MULTI',), ('INCR', key), ('EXPIRE', key, self.period, 'NX'),
+                                             ('EXEC',))
+        return count
+
+    async def reset(self, user_id):
+        await self.command('DEL', self._key(user_id))
+
+
+def create_quota_store(backend, db=None, redis_url=None, period=DAY):
+    if backend == 'memory':
+        return MemoryQuotaStore(period)
+    if backend == 'sqlite':
+        return SqliteQuotaStore(db, period)
+    if backend == 'redis':
+        return RedisQuotaStore(redis_url, period)
+    raise ValueError(f'Неизвестный QUOTA_BACKEND: {backend}')
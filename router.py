@@ -0,0 +1,78 @@
+import inspect
+
+ANY_STATE = '*'
+
+
+class RouteGroup:
+    def __init__(self, router, check=None):
+        self.router = router
+        self.check = check
+
+    def route(self, prefix, state=None):
+        """
+        Регистрирует обработчик для callback_data вида "prefix" или "prefix:arg:...".
+        state как в aiogram: None — только без состояния, '*' — в любом.
+        """
+        def decorator(handler):
+            self.router.add(prefix, self, handler, state)
+            return handler
+        return decorator
+
+
+class CallbackRouter:
+    """
+    Таблица маршрутов для callback_query: callback_data разбирается один раз на
+    префикс и аргументы, обработчик ищется в словаре, а проверка доступа
+    выполняется один раз для группы маршрутов.
+    """
+
+    def __init__(self):
+        self._routes = {}
+        self._dp = None
+
+    def group(self, check=None):
+        return RouteGroup(self, check)
+
+    def add(self, prefix, group, handler, state=None):
+        items = state if isinstance(state, (list, tuple, set, frozenset)) else [state]
+        states = frozenset(getattr(item, 'state', item) for item in items)
+        params = set(inspect.signature(handler).parameters)
+        self._routes.setdefault(prefix, []).append((group, states, handler, params))
+
+    def __contains__(self, prefix):
+        return prefix in self._routes
+
+    @staticmethod
+    def parse(data):
+        prefix, _, rest = data.partition(':')
+        return prefix, rest.split(':') if rest else []
+
+    async def dispatch(self, callback_query):
+        prefix, args = self.parse(callback_query.data or '')
+        routes = self._routes.get(prefix)
+        if routes is None:
+            return
+        state = self._dp.current_state()
+        current = None
+        checked = None
+        for group, states, handler, params in routes:
+            if group is not checked:
+                if group.check is not None and not group.check(callback_query):
+                    continue
+                checked = group
+            if ANY_STATE not in states:
+                if current is None:
+                    current = (await state.get_state(),)
+                if current[0] not in states:
+                    continue
+            kwargs = {}
+            if 'state' in params:
+                kwargs['state'] = state
+            if 'args' in params:
+                kwargs['args'] = args
+            return await handler(callback_query, **kwargs)
+
+    def register(self, dp):
+        # Без фильтров aiogram: состояние запрашивается, только если маршрут от него зависит
+        self._dp = dp
+        dp.callback_query_handlers.register(self.dispatch)
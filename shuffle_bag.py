@@ -0,0 +1,119 @@
+import logging
+import random
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+ROUNDS = 4
+MAX_MISSES = 64
+# Не чаще раза в столько секунд предупреждать о вытеснении по размеру
+EVICTION_WARNING_INTERVAL = 3600
+_FIELD = 32
+_FIELD_MASK = (1 << _FIELD) - 1
+
+
+def _round(value, seed, round_no, mask):
+    value = (value * 0x9E3779B1 + seed + round_no * 0x7F4A7C15) & 0xFFFFFFFF
+    value ^= value >> 15
+    value = (value * 0x2C1B3C6D) & 0xFFFFFFFF
+    value ^= value >> 12
+    return value & mask
+
+
+def permute(position, size, seed):
+    """
+    Псевдослучайная перестановка [0, size): сеть Фейстеля на ближайшей
+    степени двойки и cycle walking до попадания в диапазон.
+    """
+    half = max(1, ((size - 1).bit_length() + 1) // 2)
+    mask = (1 << half) - 1
+    value = position
+    while True:
+        left, right = value >> half, value & mask
+        for round_no in range(ROUNDS):
+            left, right = right, left ^ _round(right, seed, round_no, mask)
+        value = (left << half) | right
+        if value < size:
+            return value
+
+
+class ShuffleBag:
+    """
+    Выдача фраз без повторов: каждый пользователь проходит свою перестановку
+    id фраз. Состояние пользователя — одно число: seed, курсор, граница цикла
+    и время последнего запроса. Фразы, добавленные посреди цикла, попадут
+    в следующий, удалённые пропускаются.
+    Состояния лежат в LRU: не заходившие idle_ttl секунд и вытесненные сверх
+    maxsize забываются — для них просто начнётся новый цикл. Вытеснение
+    по размеру ломает обещание «без повторов», поэтому о нём пишется в лог.
+    """
+
+    def __init__(self, index, maxsize=1000000, idle_ttl=7 * 24 * 60 * 60, rng=None):
+        self.index = index
+        self.maxsize = maxsize
+        self.idle_ttl = idle_ttl
+        self.evicted = 0
+        self._states = OrderedDict()
+        self._random = rng or random.Random()
+        self._reported = 0
+        self._next_warning = 0
+
+    def __len__(self):
+        return len(self._states)
+
+    @staticmethod
+    def _pack(seed, cursor, limit, touched):
+        return (touched << (3 * _FIELD)) | (seed << (2 * _FIELD)) | (cursor << _FIELD) | limit
+
+    @staticmethod
+    def _unpack(state):
+        return ((state >> (2 * _FIELD)) & _FIELD_MASK, (state >> _FIELD) & _FIELD_MASK, state & _FIELD_MASK,
+                state >> (3 * _FIELD))
+
+    def _evict(self, now):
+        deadline = now - self.idle_ttl
+        states = self._states
+        while states:
+            state = next(iter(states.values()))
+            if len(states) <= self.maxsize and self._unpack(state)[3] > deadline:
+                break
+            if len(states) > self.maxsize:
+                self.evicted += 1
+            states.popitem(last=False)
+        if self.evicted > self._reported and now >= self._next_warning:
+            logger.warning(f"Вытеснено {self.evicted - self._reported} активных пользователей сверх "
+                           f"{self.maxsize}: их циклы начнутся заново и фразы могут повториться. "
+                           f"Увеличьте SHUFFLE_MAX_USERS")
+            self._reported = self.evicted
+            self._next_warning = now + EVICTION_WARNING_INTERVAL
+
+    def _save(self, user_id, seed, cursor, limit):
+        now = int(time.monotonic())
+        self._states[user_id] = self._pack(seed, cursor, limit, now)
+        self._states.move_to_end(user_id)
+        self._evict(now)
+
+    def _new_cycle(self):
+        return self._random.getrandbits(_FIELD), 0, self.index.max_id
+
+    def reset(self, user_id):
+        self._states.pop(user_id, None)
+
+    def next(self, user_id):
+        if not len(self.index):
+            return None
+        state = self._states.get(user_id)
+        seed, cursor, limit = self._new_cycle() if state is None else self._unpack(state)[:3]
+        for _ in range(MAX_MISSES):
+            if cursor >= limit:
+                seed, cursor, limit = self._new_cycle()
+            phrase_id = permute(cursor, limit, seed) + 1
+            cursor += 1
+            text = self.index.get(phrase_id)
+            if text is not None:
+                self._save(user_id, seed, cursor, limit)
+                return text
+        # Слишком разреженные id — не задерживаем ответ и отдаём случайную фразу
+        self._save(user_id, seed, cursor, limit)
+        return self.index.random()
@@ -0,0 +1,60 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class SubscriptionCache:
+    """
+    Ограниченный LRU-кэш результатов проверки подписки.
+    Положительный и отрицательный результаты живут разное время,
+    одновременные запросы по одному пользователю объединяются в один.
+    Ошибки не кэшируются.
+    """
+
+    def __init__(self, fetch, ttl=300, negative_ttl=30, maxsize=100000):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def invalidate(self, user_id):
+        self._entries.pop(user_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def _store(self, user_id, value):
+        ttl = self.ttl if value else self.negative_ttl
+        self._entries[user_id] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def get(self, user_id, force=False):
+        if not force:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                value, expires = entry
+                if time.monotonic() < expires:
+                    self._entries.move_to_end(user_id)
+                    return value
+                del self._entries[user_id]
+
+        pending = self._pending.get(user_id)
+        if pending is None:
+            pending = asyncio.ensure_future(self._load(user_id))
+            self._pending[user_id] = pending
+        return await asyncio.shield(pending)
+
+    async def _load(self, user_id):
+        try:
+            value = await self.fetch(user_id)
+            self._store(user_id, value)
+            return value
+        finally:
+            self._pending.pop(user_id, None)
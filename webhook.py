@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import time
+
+from aiohttp import web
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.dispatcher.webhook import BOT_DISPATCHER_KEY, WebhookRequestHandler
+
+logger = logging.getLogger(__name__)
+
+
+class InflightMiddleware(BaseMiddleware):
+    """Считает апдейты, которые сейчас обрабатываются, чтобы дождаться их при остановке."""
+
+    def __init__(self):
+        super().__init__()
+        self.inflight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def on_pre_process_update(self, update, data):
+        self.inflight += 1
+        self._idle.clear()
+
+    async def on_post_process_update(self, update, result, data):
+        self.inflight -= 1
+        if self.inflight <= 0:
+            self.inflight = 0
+            self._idle.set()
+
+    async def drain(self, timeout):
+        if self.inflight:
+            logger.info(f"Ожидание завершения {self.inflight} обработчиков")
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не дождались {self.inflight} обработчиков за {timeout} с")
+
+
+def secret_token_middleware(secret, webhook_path):
+    @web.middleware
+    async def check_secret(request, handler):
+        if request.path == webhook_path and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret:
+            raise web.HTTPUnauthorized()
+        return await handler(request)
+    return check_secret
+
+
+def start_webhook(dp, webhook_path, host, port, webhook_url=None, secret=None, on_startup=None,
+                  on_shutdown=None, skip_updates=True, drain_timeout=30, health_stats=None):
+    """
+    Запуск бота через webhook на aiohttp. Кроме webhook_path отдаёт /health,
+    куда добавляется словарь из health_stats().
+    Без webhook_url вебхук в Telegram не регистрируется — так удобно
+    проверять бота локально, отправляя POST с записанными апдейтами.
+    """
+    inflight = InflightMiddleware()
+    dp.middleware.setup(inflight)
+    started_at = time.monotonic()
+
+    app = web.Application(middlewares=[secret_token_middleware(secret, webhook_path)] if secret else [])
+
+    async def health(request):
+        status = {
+            'status': 'ok',
+            'inflight': inflight.inflight,
+            'uptime': round(time.monotonic() - started_at, 1),
+        }
+        if health_stats is not None:
+            status.update(health_stats())
+        return web.json_response(status)
+
+    app.router.add_get('/health', health)
+
+    app[BOT_DISPATCHER_KEY] = dp
+    app.router.add_route('*', webhook_path, WebhookRequestHandler, name='webhook_handler')
+
+    async def startup(_):
+        if on_startup is not None:
+            await on_startup(dp)
+        if webhook_url:
+            await dp.bot.set_webhook(webhook_url + webhook_path, secret_token=secret,
+                                     drop_pending_updates=skip_updates)
+            logger.info(f"Webhook установлен: {webhook_url}{webhook_path}")
+
+    async def shutdown(_):
+        # Сервер уже не принимает соединения, дожидаемся начатых обработчиков
+        await inflight.drain(drain_timeout)
+        if on_shutdown is not None:
+            await on_shutdown(dp)
+        await dp.storage.close()
+        await dp.storage.wait_closed()
+        session = await dp.bot.get_session()
+        await session.close()
+
+    app.on_startup.append(startup)
+    app.on_shutdown.append(shutdown)
+    web.run_app(app, host=host, port=port)